@@ -2,105 +2,101 @@
 import pandas as pd
 import numpy as onp
 from scipy import stats
-import jax.numpy as np
 from pprint import pprint
 
 import pickle
 import os
 
-from numpyro.diagnostics import hpdi
-
 import helpers as h
+import design_helpers as dh
+import enrichment_helpers as eh
 import plot_helpers as ph
 
 # %%
 direc = '.'
 #%% read in samples from posterior for effect of conditions on gene expression
-with open(os.path.join(direc,'big_horseshoe_model_samples.pkl'), 'rb') as pkl_file:
-    samples = pickle.load(pkl_file)
+# samples are memory-mapped from one .npy file per parameter. Those files are
+#   written from the sample store or pickle from the fit the first time
+#   through, and again whenever the fit rewrites it. Fits that pickle their
+#   samples leave an older store in place, so use whichever was written last.
+samples_npy_dir = os.path.join(direc,'big_horseshoe_model_samples_npy')
+sample_store = os.path.join(direc,'big_horseshoe_model_samples.h5')
+samples_source = max(
+    [path for path in [sample_store, os.path.join(direc,'big_horseshoe_model_samples.pkl')] if os.path.exists(path)],
+    key=os.path.getmtime
+)
+if not h.samples_npy_is_current(samples_npy_dir, samples_source):
+    if samples_source == sample_store:
+        with h.open_sample_store(sample_store) as store:
+            h.save_samples_npy(store, samples_npy_dir, source_path=samples_source)
+    else:
+        with open(samples_source, 'rb') as pkl_file:
+            h.save_samples_npy(pickle.load(pkl_file), samples_npy_dir, source_path=samples_source)
+
+samples = h.load_samples_npy(samples_npy_dir, params=['alpha','b_condition'])
 
 #%% read in data
-data = pd.read_csv(
-    os.path.join(direc, 'data_long_with_design_info.csv.gz')
-)
+data = dh.load_design_table(direc)
 
 # %% wrangle the data to get some useful lookups
-gene_info_df = data[~data.gene_lookup.duplicated()][['Name','Locus_tag','headon','gene_lookup']]
-gene_info_df['Direction'] = gene_info_df.headon.replace({0:"Codirectional",1:"Head-on"})
-cond_info_df = data[~data.condition_lookup.duplicated()][['condition','condition_lookup']]
-
-gene_lookup = dict(
-    zip(
-        gene_info_df.Locus_tag.values,
-        gene_info_df.gene_lookup.values
-    )
-)
-gene_reverse_lookup = {val:k for k,val in gene_lookup.items()}
-condition_lookup = dict(
-    zip(
-        cond_info_df.condition.values,
-        cond_info_df.condition_lookup.values
-    )
-)
-condition_reverse_lookup = {val:k for k,val in condition_lookup.items()}
+# ids index the vocabularies saved by create_gene_info.py
+vocabularies = dh.load_vocabularies(direc)
+gene_vocabulary = vocabularies['gene']
+condition_vocabulary = vocabularies['condition']
 
-locus_tags = data[~data.Locus_tag.duplicated()]['Locus_tag']
-genes = data[~data.Locus_tag.duplicated()]['Name']
-locus_tag_lookup = dict(zip(locus_tags, genes))
-locus_tag_reverse_lookup = {v:k for k,v in locus_tag_lookup.items()}
+gene_info_df = data[~data.gene_lookup.duplicated()][['Name','Locus_tag','headon','gene_lookup']]
+gene_info_df['Direction'] = onp.where(gene_info_df.headon.values == 1, "Head-on", "Codirectional")
+# gene names in gene id order
+gene_names = onp.empty(len(gene_vocabulary), dtype=object)
+gene_names[gene_info_df.gene_lookup.values] = onp.asarray(gene_info_df.Name, dtype=object)
 
 # %% set LB exponential growth as intercept and get each conditions effect relative to LBexp baseline
-LBexp_idx = condition_lookup['LBexp']
-
-# calculate new samples for each gene's intercept (alpha) by adding LBexp beta to original alpha
-new_alphas = samples['alpha'] + samples['b_condition'][:,:,LBexp_idx]
-# calculate new betas by subtracting LBexp beta from each beta
-new_betas = onp.zeros(samples['b_condition'].shape)
-for i in range(new_betas.shape[2]):
-    new_betas[:,:,i] = samples['b_condition'][:,:,i] - samples['b_condition'][:,:,LBexp_idx]
+LBexp_idx = dh.encode(['LBexp'], condition_vocabulary)[0]
+
+# new samples for each gene's intercept (alpha) add the LBexp beta to the original alpha,
+#   new betas subtract the LBexp beta from each beta
+new_alphas, new_betas = h.rereference(
+    samples['alpha'],
+    samples['b_condition'],
+    LBexp_idx,
+    dtype=onp.float32
+)
 
 #%%
 samples['new_alpha'] = new_alphas
 samples['new_beta'] = new_betas
 
 #%%
-gene_trends_df = h.get_mean_and_ci(
+gene_trends_df = h.summarize_samples(
     samples['new_beta'],
     key_name='condition_lookup',
     id_var='gene_lookup'
 )
-gene_trends_df.reset_index(inplace=True)
 
 # %%
-gene_trends_df['locus_tag'] = gene_trends_df.gene_lookup.replace(gene_reverse_lookup).values
-gene_trends_df['gene'] = gene_trends_df.locus_tag.replace(locus_tag_lookup).values
-gene_trends_df['condition'] = gene_trends_df.condition_lookup.replace(condition_reverse_lookup).values
+gene_trends_df['locus_tag'] = dh.decode(gene_trends_df.gene_lookup.values, gene_vocabulary)
+gene_trends_df['gene'] = gene_names[gene_trends_df.gene_lookup.values]
+gene_trends_df['condition'] = dh.decode(gene_trends_df.condition_lookup.values, condition_vocabulary)
 
 #%%
-gene_info_df['locus_tag'] = gene_info_df.Locus_tag
+gene_info_df['locus_tag'] = onp.asarray(gene_info_df.Locus_tag, dtype=object)
 gene_trends_df = gene_trends_df.join(gene_info_df.drop(columns=["Name","Locus_tag","gene_lookup"]).set_index('locus_tag'), on='locus_tag')
 
-#%%
-for_gini = onp.zeros(samples['new_beta'].shape)
-for i in range(for_gini.shape[0]):
-    for_gini[i,...] = h.prep_for_gini(samples['new_beta'][i,...])
-
-#%%
-gini_arr = onp.zeros((for_gini.shape[0],for_gini.shape[1]))
-for i in range(gini_arr.shape[0]):
-    gini_arr[i,:] = h.gini(for_gini[i,:,:])
-
-# %%
-mean_gini = np.mean(gini_arr, axis=0)
-gini_low,gini_up = hpdi(gini_arr, prob=0.9, axis=0)
+#%% Gini coefficient of each gene's condition effects, for every posterior draw
+mean_gini,gini_low,gini_up,gini_arr = h.gini_summary(
+    samples['new_beta'],
+    prob=0.9,
+    chunk_size=50,
+    return_draws=True
+)
 
 gini_df = pd.DataFrame(
     {'mean_val':mean_gini,
      'lower_cl':gini_low,
      'upper_cl':gini_up,
-     'locus_tag':[k for k in gene_lookup.keys()]}
+     'locus_tag':gene_vocabulary[:len(mean_gini)]}
 )
-gini_df['gene'] = gini_df.locus_tag.replace(locus_tag_lookup)
+gini_df['gene'] = gene_names[:len(mean_gini)]
 gini_df = gini_df.join(gene_info_df.set_index('locus_tag'), on='locus_tag').drop(columns='Name')
 gini_df = gini_df.sort_values('mean_val')
 gini_df['x_vals'] = onp.arange(gini_df.shape[0])
@@ -121,3 +117,36 @@ gini_density_plot
 # %%
 gini_density_plot.save('gini_distribution_horseshoe.png')
 gini_density_plot.save('gini_distribution_horseshoe.svg')
+
+#%% posterior distribution of the difference in mean Gini coefficient between
+#   head-on and co-directional genes in the regulon of every Subtiwiki regulator
+regulations = pd.read_csv(os.path.join(direc, 'Subtiwiki_regulations.csv'))
+regulations['locus_tag'] = regulations['locus tag'].str.replace('_','')
+
+gene_count = gini_arr.shape[1]
+regulon_membership, regulators = eh.membership_matrix(
+    regulations,
+    gene_vocabulary[:gene_count]
+)
+gene_headon = onp.zeros(gene_count)
+gene_headon[gene_info_df.gene_lookup.values] = gene_info_df.headon.values
+
+regulon_gini = eh.posterior_regulon_effects(gini_arr, regulon_membership, gene_headon)
+
+# %%
+gini_difference = regulon_gini['difference']
+gini_difference_low,gini_difference_up = h.batched_hpdi(gini_difference, probs=(0.9,))[0.9]
+regulon_gini_df = regulators.assign(
+    headon_members = regulon_membership.T @ gene_headon,
+    codir_members = regulon_membership.T @ (1 - gene_headon),
+    headon_mean_gini = regulon_gini['headon_mean'].mean(axis=0),
+    codir_mean_gini = regulon_gini['codir_mean'].mean(axis=0),
+    mean_val = gini_difference.mean(axis=0),
+    lower_cl = gini_difference_low,
+    upper_cl = gini_difference_up,
+    prob_positive = (gini_difference > 0).mean(axis=0),
+)
+# regulons without both head-on and co-directional members have no difference
+regulon_gini_df = regulon_gini_df.dropna(subset=['mean_val']).sort_values('mean_val')
+regulon_gini_df.to_csv('regulon_gini_differences.csv', index=False)
+regulon_gini_df
@@ -1,58 +1,225 @@
 #%%
-import numpy as onp
-
 import jax.random as random
 
-import pandas as pd
 import pickle
 import os
 
 import helpers as h
+import design_helpers as dh
+
+# host devices and compilation cache, before any JAX code runs
+h.init()
 
 # %%
 direc = '.'
-data = pd.read_csv(os.path.join(direc, 'data_long_with_design_info.csv.gz'))
 
-#%% check number of y-vals for each gene, important later for horseshoe prior
-y_val_count = []
-for gid in onp.unique(data.gene_lookup.values):
-    y_val_count.append(data[data.gene_lookup==gid].shape[0])
+num_warmup, num_samples = 1000,500
+# run one chain per host device set up in helpers, in parallel
+num_chains = None
+chain_method = 'parallel'
+# programs run with a progress bar can't go in the compilation cache, so fits
+#   run without one. Checkpointed fits, which warm_up_fit.py compiles ahead,
+#   always print their progress after each checkpoint instead.
+progress_bar = False
 
-# %%
-N = onp.unique(y_val_count)[0] # all genes have 269 y-values
+# set shard_size to a number of genes to fit blocks of genes in parallel
+#   processes instead of all genes in one model. None fits all genes at once.
+shard_size = None
+# number of shards fit at once. None runs one shard per num_chains cores
+#   (per core with chain_method = 'sequential'), each shard's chains on its
+#   own host devices, so all chains together run about one per core.
+max_workers = None
 
-#%%
-# Start from this source of randomness.
-rng_key = random.PRNGKey(0)
-rng_key, rng_key_ = random.split(rng_key)
+# set cell_likelihood to True to fit horseshoe_cell_model, which only has
+#   parameters for observed gene/condition cells and evaluates the likelihood
+#   once per cell from the replicates' sufficient statistics
+cell_likelihood = False
 
-num_warmup, num_samples = 1000,500
-num_chains = 1
+# set use_svi to True for a quick approximate fit by SVI instead of NUTS,
+#   minibatching gene_batch_size genes per step
+use_svi = False
+svi_steps = 20000
+gene_batch_size = 500
 
-#%%
-data_dict = {
-    'y_vals':data.log2signal.values,
-    'gid':data.gene_lookup.values,
-    'cid':data.condition_lookup.values,
-    'N':N # number of y-vals for each gene, calculated above
-}
-
-samples = h.sample_model(
-    rng_key,
-    model=h.horseshoe_model,
-    model_args_dict=data_dict,
-    num_warmup=num_warmup,
-    num_samples=num_samples,
-    num_chains=num_chains
-)
+# sampler state and sample batches are saved to checkpoint_dir every
+#   checkpoint_every iterations. Rerunning the script resumes from the last
+#   checkpoint. Set checkpoint_dir to None to sample without checkpoints.
+checkpoint_dir = os.path.join(direc, 'big_horseshoe_model_checkpoints')
+checkpoint_every = 100
 
-#%%
-# no need to keep these horseshoe priors, just keep alpha and bC
-del samples['beta_tilde']
-del samples['lambd']
-del samples['tau_tilde']
-del samples['c2_tilde']
+# to refit after genes or conditions were added to the data, point
+#   previous_fit_state at the mcmc_state.pkl of the previous fit's checkpoints
+#   (moved out of checkpoint_dir). NUTS then starts from its step size, mass
+#   matrix and parameter values, and only needs a short warmup, which keeps
+#   the mass matrix and only adapts the step size. Warm starts need
+#   cell_likelihood = False and the plain or checkpointed fit.
+previous_fit_state = None
+warm_start_num_warmup = 200
 
-#%%
-with open('big_horseshoe_model_samples.pkl','wb') as pkl_file:
-    pickle.dump(samples, pkl_file)
\ No newline at end of file
+# with checkpointing, samples of alpha, b_condition and sigma are streamed
+#   into this chunked, compressed HDF5 store while sampling runs, instead
+#   of being collected in memory and pickled at the end.
+sample_store = os.path.join(direc, 'big_horseshoe_model_samples.h5')
+
+# set condition_subsets to fit the model separately to groups of conditions,
+#   e.g. {'LB':['LBexp','LBtran','LBstat'], 'LBG':['LBGexp','LBGtran','LBGstat']}.
+#   Each group's model arguments are cached in subset_cache_dir. Groups are fit
+#   with horseshoe_grid_model on each cell's sufficient statistics, so groups
+#   with the same numbers of genes and conditions reuse one compiled sampler,
+#   whatever their numbers of replicates.
+condition_subsets = None
+subset_cache_dir = os.path.join(direc, 'condition_subsets')
+
+def model_and_data(data, N):
+    """The model set by cell_likelihood and its arguments for the design table data.
+
+    warm_up_fit.py compiles the fit for exactly these arguments, so both
+    scripts build them here.
+    """
+    if cell_likelihood:
+        model = h.horseshoe_cell_model
+        data_dict = h.aggregate_cells(
+            data.log2signal.values,
+            data.gene_lookup.values,
+            data.condition_lookup.values
+        )
+        data_dict['N'] = N # number of y-vals for each gene
+    else:
+        model = h.horseshoe_model
+        data_dict = {
+            'y_vals':data.log2signal.values,
+            'gid':data.gene_lookup.values,
+            'cid':data.condition_lookup.values,
+            'N':N # number of y-vals for each gene
+        }
+    return model, data_dict
+
+# the sharded fit starts worker processes that re-import this script,
+#   so everything below only runs in the main process.
+if __name__ == '__main__':
+
+    data = dh.load_design_table(direc)
+
+    #%% check the design and count y-vals for each gene, important later for horseshoe prior
+    design_counts = dh.validate_design(data)
+    # one number when all genes have the same count (269 y-values in the
+    #   original data), otherwise an array with each gene's count
+    N = design_counts['N']
+
+    #%%
+    # Start from this source of randomness.
+    rng_key = random.PRNGKey(0)
+    rng_key, rng_key_ = random.split(rng_key)
+
+    warm_start = None
+    if previous_fit_state is not None:
+        # only the single-model NUTS fits below start from a previous fit
+        if condition_subsets is not None or use_svi or shard_size is not None:
+            raise ValueError('previous_fit_state only works without condition_subsets, use_svi or shard_size')
+        num_warmup = warm_start_num_warmup
+
+    #%%
+    model, data_dict = model_and_data(data, N)
+
+    if previous_fit_state is not None:
+        warm_start = h.warm_start_from_checkpoint(previous_fit_state, model, data_dict)
+
+    if condition_subsets is not None:
+        condition_vocabulary = dh.load_vocabularies(direc)['condition']
+        subset_args = {}
+        subset_ids = {}
+        for name,conditions in condition_subsets.items():
+            subset_args[name],subset_ids[name] = dh.condition_subset_args(
+                data,
+                conditions,
+                condition_vocabulary,
+                cache_dir=subset_cache_dir,
+                design_path=dh.design_table_path(direc)
+            )
+        subset_samples = h.sample_condition_subsets(
+            rng_key,
+            model=h.horseshoe_grid_model,
+            subset_args=subset_args,
+            num_warmup=num_warmup,
+            num_samples=num_samples,
+            num_chains=num_chains,
+            chain_method=chain_method,
+            progress_bar=progress_bar
+        )
+        # gene_ids and condition_ids give the original ids of each subset's genes and conditions
+        for name,subset_sample in subset_samples.items():
+            with open('big_horseshoe_model_samples_{}.pkl'.format(name),'wb') as pkl_file:
+                pickle.dump({**subset_sample, **subset_ids[name]}, pkl_file)
+        samples = None
+
+    elif use_svi:
+        svi_dict = h.aggregate_cells(
+            data.log2signal.values,
+            data.gene_lookup.values,
+            data.condition_lookup.values,
+            dense=True
+        )
+        svi_dict['N'] = N
+        svi_dict['gene_batch_size'] = gene_batch_size
+        samples = h.fit_svi(
+            rng_key,
+            model=h.horseshoe_grid_model,
+            model_args_dict=svi_dict,
+            num_steps=svi_steps,
+            num_samples=num_samples
+        )
+
+    elif shard_size is not None:
+        # only alpha, b_condition and sigma come back from the shards
+        samples = h.sample_model_sharded(
+            rng_key,
+            model=model,
+            model_args_dict=data_dict,
+            shard_size=shard_size,
+            max_workers=max_workers,
+            num_warmup=num_warmup,
+            num_samples=num_samples,
+            num_chains=num_chains,
+            chain_method=chain_method,
+            checkpoint_dir=checkpoint_dir,
+            checkpoint_every=checkpoint_every,
+            progress_bar=progress_bar
+        )
+
+    elif checkpoint_dir is not None:
+        samples = h.sample_model_checkpointed(
+            rng_key,
+            model=model,
+            model_args_dict=data_dict,
+            checkpoint_dir=checkpoint_dir,
+            num_warmup=num_warmup,
+            num_samples=num_samples,
+            num_chains=num_chains,
+            chain_method=chain_method,
+            checkpoint_every=checkpoint_every,
+            sample_store=sample_store,
+            warm_start=warm_start
+        )
+
+    else:
+        samples = h.sample_model(
+            rng_key,
+            model=model,
+            model_args_dict=data_dict,
+            num_warmup=num_warmup,
+            num_samples=num_samples,
+            num_chains=num_chains,
+            chain_method=chain_method,
+            warm_start=warm_start,
+            progress_bar=progress_bar
+        )
+
+    #%%
+    # samples streamed to sample_store are already on disk
+    if isinstance(samples, dict):
+        # no need to keep these horseshoe priors, just keep alpha and bC
+        for param in ['beta_tilde','lambd','tau_tilde','c2_tilde']:
+            samples.pop(param, None)
+
+        with open('big_horseshoe_model_samples.pkl','wb') as pkl_file:
+            pickle.dump(samples, pkl_file)
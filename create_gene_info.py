@@ -1,34 +1,29 @@
 #%%
 import pandas as pd
+import os
+
+import design_helpers as dh
 
 # %%
 direc = '.'
 data = pd.read_csv(os.path.join(direc, 'data_long.csv.gz'))
 
-#%%
-gene_lookup = dict(
-    zip(
-        data.Locus_tag.unique(),
-        range(len(data.Locus_tag.unique()))
-    )
-)
-
-condition_lookup = dict(
-    zip(
-        data.condition.unique(),
-        range(len(data.condition.unique()))
-    )
-)
+# when incremental is True, genes and conditions already in the saved
+#   gene_vocabulary.csv and condition_vocabulary.csv keep their ids, and new
+#   ones are given the next ids, so a previous fit can warm start a refit on
+#   the new data
+incremental = True
 
 # %%
-data['gene_lookup'] = data.Locus_tag.replace(gene_lookup).values
-data['condition_lookup'] = data.condition.replace(condition_lookup).values
+data = dh.encode_design(data, direc, incremental=incremental)
 
 #%%
 data.to_csv(
     'data_long_with_design_info.csv.gz',
     index=False,
-    columns=["Name","Locus_tag","headon","condition","replicate","log2signal","gene_lookup","condition_lookup"]
+    columns=dh.design_table_columns
 )
+# the same table with compact dtypes, which the other scripts load
+dh.save_design_table(data, direc)
 
 # %%
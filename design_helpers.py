@@ -0,0 +1,325 @@
+import numpy as onp
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import hashlib
+import os
+
+from helpers.cells import aggregate_cells
+
+#%% vocabularies map integer ids (the position in the vocabulary) to values.
+# they are saved next to the data so every script encodes and decodes
+#   genes and conditions with the same ids.
+design_columns = {
+    # name: (column of values, column of ids)
+    'gene':('Locus_tag','gene_lookup'),
+    'condition':('condition','condition_lookup'),
+}
+
+def vocabulary_path(direc, name):
+    return os.path.join(direc, '{}_vocabulary.csv'.format(name))
+
+def load_vocabulary(path):
+    """Values of the vocabulary saved at path, in id order (empty if there is none)."""
+    if not os.path.exists(path):
+        return onp.array([], dtype=object)
+    vocabulary = pd.read_csv(path, dtype={'value':str}, keep_default_na=False)['value']
+    return onp.asarray(vocabulary, dtype=object)
+
+def save_vocabulary(vocabulary, path):
+    pd.DataFrame(
+        {'id':onp.arange(len(vocabulary)), 'value':vocabulary}
+    ).to_csv(path, index=False)
+
+def load_vocabularies(direc):
+    """Gene and condition vocabularies saved in direc."""
+    return {name:load_vocabulary(vocabulary_path(direc, name)) for name in design_columns}
+
+def extend_vocabulary(vocabulary, values):
+    """vocabulary with values it does not contain appended, in order of first appearance."""
+    uniques = pd.unique(onp.asarray(values))
+    new_values = uniques[~pd.Index(uniques).isin(vocabulary)]
+    return onp.concatenate([onp.asarray(vocabulary, dtype=object), new_values.astype(object)])
+
+def encode(values, vocabulary):
+    """Integer ids of values in vocabulary; values not in it get -1."""
+    return pd.Categorical(values, categories=vocabulary).codes
+
+def decode(ids, vocabulary):
+    """Values of vocabulary for integer ids."""
+    return onp.asarray(vocabulary)[ids]
+
+def encode_design(data, direc, incremental=True):
+    """Add gene_lookup and condition_lookup ids to data, saving the vocabularies in direc.
+
+    With incremental=True, ids in saved vocabularies are kept and new genes
+    and conditions get the next ids.
+    """
+    for name,(value_column,id_column) in design_columns.items():
+        path = vocabulary_path(direc, name)
+        vocabulary = load_vocabulary(path) if incremental else onp.array([], dtype=object)
+        vocabulary = extend_vocabulary(vocabulary, data[value_column].values)
+        data[id_column] = encode(data[value_column].values, vocabulary)
+        save_vocabulary(vocabulary, path)
+
+    return data
+
+#%% the long-format table with design ids is also stored as parquet, with
+#   compact dtypes, which loads much faster than parsing the gzipped csv.
+design_table_columns = [
+    "Name","Locus_tag","headon","condition","replicate","log2signal","gene_lookup","condition_lookup"
+]
+design_table_dtypes = {
+    'Name':'category',
+    'Locus_tag':'category',
+    'headon':'int8',
+    'condition':'category',
+    'gene_lookup':'int32',
+    'condition_lookup':'int16',
+}
+
+def design_table_path(direc, ext='parquet'):
+    return os.path.join(direc, 'data_long_with_design_info.{}'.format(ext))
+
+def compact_design_table(data):
+    """data with the columns in design_table_dtypes cast to their compact dtypes."""
+    return data.astype(
+        {col:dtype for col,dtype in design_table_dtypes.items() if col in data.columns}
+    )
+
+def save_design_table(data, direc):
+    """Write data to data_long_with_design_info.parquet in direc."""
+    path = design_table_path(direc)
+    compact_design_table(
+        data[[col for col in design_table_columns if col in data.columns]]
+    ).to_parquet(path, index=False)
+    return path
+
+def load_design_table(direc, columns=None):
+    """Long-format table with design ids, from parquet if there is one, else from the csv."""
+    path = design_table_path(direc)
+    if os.path.exists(path):
+        return pd.read_parquet(path, columns=columns)
+    data = pd.read_csv(design_table_path(direc, 'csv.gz'), usecols=columns)
+    return compact_design_table(data)
+
+#%% checks on the design before fitting
+def design_counts(gene_lookup, condition_lookup):
+    """Number of observations for each gene id and each condition id."""
+    gene_lookup = onp.asarray(gene_lookup)
+    condition_lookup = onp.asarray(condition_lookup)
+    return {
+        'gene_n':onp.bincount(gene_lookup, minlength=gene_lookup.max()+1),
+        'condition_n':onp.bincount(condition_lookup, minlength=condition_lookup.max()+1),
+    }
+
+def validate_design(data, value_column='log2signal'):
+    """Check the ids and values in data and count observations per gene and condition.
+
+    Raises ValueError if any ids are negative or unused, or any values are missing.
+    Returns design_counts plus N, the number of observations of each gene for
+    the horseshoe prior: one number if every gene has the same count, else an
+    array indexed by gene id.
+    """
+    for _,id_column in design_columns.values():
+        if (data[id_column].values < 0).any():
+            raise ValueError('{} has negative ids'.format(id_column))
+    if data[value_column].isna().any():
+        raise ValueError('{} has missing values'.format(value_column))
+
+    counts = design_counts(data.gene_lookup.values, data.condition_lookup.values)
+    for key,val in counts.items():
+        if (val == 0).any():
+            raise ValueError(
+                'no observations for {} ids {}'.format(key[:-2], onp.flatnonzero(val == 0))
+            )
+
+    gene_n = counts['gene_n']
+    if (gene_n == gene_n[0]).all():
+        counts['N'] = int(gene_n[0])
+    else:
+        counts['N'] = gene_n
+    return counts
+
+#%% streaming ingestion of Table S2 from Nicolas et al., in place of nicolas_analysis.R
+# sample columns of Table S2 are named <condition>[/<other>]_<replicate>_hyb<chip id>
+first_sample_column = 'LBexp_1_hyb25350202'
+last_sample_column = 'MG+150_3_hyb14630502'
+condition_renames = {'MG+t5':'MG+5'}
+
+def parse_sample_column(column):
+    """Condition, replicate, sample key and chip id encoded in a Table S2 sample column name."""
+    fields = column.split('_')
+    condition, replicate, hyb_id = fields[:3]
+    return {
+        'sample_column':column,
+        'sample_key':'{}_{}'.format(condition, replicate),
+        'chip_id':'_'.join([hyb_id[len('hyb'):]] + fields[3:]),
+        'condition':condition_renames.get(condition.split('/')[0], condition.split('/')[0]),
+        'replicate':int(replicate),
+    }
+
+def sample_info(sample_columns, table_s1_path):
+    """One row per sample column, with the matching Table S1 metadata joined on chip id."""
+    samples = pd.DataFrame([parse_sample_column(col) for col in sample_columns])
+    table_s1 = pd.read_csv(table_s1_path, sep='\t', dtype={'Chip Id':str})
+    table_s1 = table_s1.rename(columns={'Chip Id':'chip_id', 'Condition key *':'condition_key'})
+    samples = samples.merge(table_s1, on='chip_id', how='left', validate='one_to_one')
+
+    missing = samples.condition_key.isna()
+    if missing.any():
+        raise ValueError('samples not in Table S1: {}'.format(list(samples.sample_column[missing])))
+    mismatched = samples.condition_key != samples.sample_key
+    if mismatched.any():
+        raise ValueError('Table S1 condition keys do not match samples: {}'.format(
+            list(samples.sample_column[mismatched])
+        ))
+    return samples
+
+def _sample_columns(path):
+    columns = pd.read_csv(path, nrows=0).columns
+    first = columns.get_loc(first_sample_column)
+    last = columns.get_loc(last_sample_column)
+    return list(columns[first:last+1])
+
+def _rtp_end(path, chunksize):
+    # end of rtp, which sets which genes are head-on, from a pass over two columns
+    for chunk in pd.read_csv(path, usecols=['Name','EndV3'], chunksize=chunksize):
+        rtp = chunk.EndV3.values[chunk.Name.values == 'rtp']
+        if rtp.shape[0] > 0:
+            return rtp[0]
+    raise ValueError('rtp is not in {}'.format(path))
+
+def ingest_table_s2(table_s2_path, table_s1_path, direc, incremental=True, chunksize=500):
+    """Melt Table S2 to the long-format design table, one chunk of genes at a time.
+
+    Keeps genes with BSU locus tags, marks genes head-on or codirectional
+    relative to rtp, encodes genes and conditions against the vocabularies in
+    direc and writes data_long_with_design_info.parquet and sample_info.csv.
+    Only one chunk of Table S2 is in memory at a time.
+    """
+    sample_columns = _sample_columns(table_s2_path)
+    samples = sample_info(sample_columns, table_s1_path)
+    samples.to_csv(os.path.join(direc, 'sample_info.csv'), index=False)
+    rtp_end = _rtp_end(table_s2_path, chunksize)
+
+    vocabularies = {
+        name:load_vocabulary(vocabulary_path(direc, name)) if incremental else onp.array([], dtype=object)
+        for name in design_columns
+    }
+    # conditions are known from the column names, so get their ids up front
+    vocabularies['condition'] = extend_vocabulary(vocabularies['condition'], samples.condition.values)
+    sample_condition_lookup = encode(samples.condition.values, vocabularies['condition'])
+
+    writer = None
+    chunks = pd.read_csv(
+        table_s2_path,
+        usecols=['Name','Locus_tag','StartV3','Strand'] + sample_columns,
+        chunksize=chunksize
+    )
+    for chunk in chunks:
+        chunk = chunk[chunk.Locus_tag.str.match('^BSU', na=False)]
+        if chunk.shape[0] == 0:
+            continue
+        locus_tags = chunk.Locus_tag.values
+        vocabularies['gene'] = extend_vocabulary(vocabularies['gene'], locus_tags)
+
+        plus_strand = chunk.Strand.values == 1
+        headon = onp.where(chunk.StartV3.values > rtp_end, plus_strand, ~plus_strand)
+
+        # sample-major, like gather in nicolas_analysis.R
+        gene_count = chunk.shape[0]
+        sample_count = len(sample_columns)
+        long_chunk = compact_design_table(pd.DataFrame({
+            'Name':onp.tile(chunk.Name.values, sample_count),
+            'Locus_tag':onp.tile(locus_tags, sample_count),
+            'headon':onp.tile(headon, sample_count),
+            'condition':onp.repeat(samples.condition.values, gene_count),
+            'replicate':onp.repeat(samples.replicate.values, gene_count),
+            'log2signal':chunk[sample_columns].values.ravel(order='F'),
+            'gene_lookup':onp.tile(encode(locus_tags, vocabularies['gene']), sample_count),
+            'condition_lookup':onp.repeat(sample_condition_lookup, gene_count),
+        }))
+
+        table = pa.Table.from_pandas(long_chunk, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(design_table_path(direc), table.schema)
+        writer.write_table(table.cast(writer.schema))
+
+    if writer is None:
+        raise ValueError('no BSU genes in {}'.format(table_s2_path))
+    writer.close()
+
+    for name,vocabulary in vocabularies.items():
+        save_vocabulary(vocabulary, vocabulary_path(direc, name))
+
+    return design_table_path(direc)
+
+#%% model arguments for fits to subsets of conditions, cached in memory and
+#   as .npz files in cache_dir so reruns on the same subset skip the design table
+_subset_cache = {}
+
+def _subset_key(conditions, row_count, design_path):
+    # a subset is identified by its conditions and the design table it came from
+    sha = hashlib.sha1('\n'.join(conditions + [str(row_count)]).encode())
+    if design_path is not None and os.path.exists(design_path):
+        stat = os.stat(design_path)
+        sha.update('{}:{}:{}'.format(design_path, stat.st_mtime_ns, stat.st_size).encode())
+    return sha.hexdigest()[:16]
+
+def condition_subset_args(data, conditions, condition_vocabulary, cache_dir=None, design_path=None):
+    """horseshoe_grid_model arguments for the rows of data in conditions.
+
+    conditions is a list of condition names. Conditions are re-indexed
+    0..len(conditions)-1 in the order given, and genes from 0 in id order.
+    design_path, the file data was loaded from, invalidates cached subsets
+    when it changes. Returns the model arguments and the original gene and
+    condition ids of the new ids. The arguments are each cell's sufficient
+    statistics as genes x conditions arrays, plus each gene's N, so subsets
+    with the same numbers of genes and conditions have the same shapes
+    whatever their numbers of replicates.
+    """
+    conditions = list(conditions)
+    key = _subset_key(conditions, data.shape[0], design_path)
+    if key in _subset_cache:
+        return _subset_cache[key]
+
+    cache_path = None if cache_dir is None else os.path.join(cache_dir, 'subset_{}.npz'.format(key))
+    if cache_path is not None and os.path.exists(cache_path):
+        with onp.load(cache_path) as cached:
+            arrays = dict(cached)
+    else:
+        condition_ids = encode(conditions, condition_vocabulary)
+        if (condition_ids < 0).any():
+            raise ValueError('conditions not in data: {}'.format(
+                [c for c,i in zip(conditions, condition_ids) if i < 0]
+            ))
+        new_cid = onp.full(data.condition_lookup.max()+1, -1)
+        new_cid[condition_ids] = onp.arange(len(condition_ids))
+
+        cid = new_cid[data.condition_lookup.values]
+        keep = cid >= 0
+        gene_ids,gid = onp.unique(data.gene_lookup.values[keep], return_inverse=True)
+        arrays = {
+            'y_vals':data.log2signal.values[keep],
+            'gid':gid.astype(onp.int32),
+            'cid':cid[keep].astype(onp.int32),
+            'gene_ids':gene_ids,
+            'condition_ids':condition_ids.astype(onp.int32),
+        }
+        if cache_path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            onp.savez(cache_path, **arrays)
+
+    model_args = aggregate_cells(
+        arrays['y_vals'],
+        arrays['gid'],
+        arrays['cid'],
+        dense=True,
+        gene_count=len(arrays['gene_ids']),
+        condition_count=len(arrays['condition_ids'])
+    )
+    model_args['N'] = onp.bincount(arrays['gid'], minlength=len(arrays['gene_ids']))
+    ids = {'gene_ids':arrays['gene_ids'], 'condition_ids':arrays['condition_ids']}
+    _subset_cache[key] = (model_args, ids)
+    return model_args, ids
@@ -1,12 +1,11 @@
 #%%
 import pandas as pd
 import numpy as onp
-from scipy import stats
 from pprint import pprint
-from Bio import SeqIO
 import os
 
-import helpers as h
+import genome_helpers as gh
+import enrichment_helpers as eh
 import plot_helpers as ph
 
 # %%
@@ -17,153 +16,102 @@ regulations = pd.read_csv(os.path.join(direc, 'Subtiwiki_regulations.csv'))
 regulations['locus_tag'] = regulations['locus tag'].str.replace('_','')
 
 #%%
-# read in B. subtilis 168 genome
-refseq = SeqIO.read(
-    os.path.join(direc, 'B_subtilis_168_NC_000964.3.gbk'),
-    'genbank',
+# CDSs of the B. subtilis 168 genome, with head-on or co-directional status.
+#   The GenBank file is parsed on the first run and the table cached next to it.
+cds_df = gh.load_cds_table(os.path.join(direc, 'B_subtilis_168_NC_000964.3.gbk'))
+
+#%% membership of every CDS in the regulon of every Subtiwiki regulator,
+#   with all modes of regulation together and with each mode separately
+regulator_membership, regulators = eh.membership_matrix(
+    regulations,
+    cds_df.locus_tag.values
 )
-# get CDSs from 168 genome
-CDS = [feat for feat in refseq.features if feat.type == "CDS"]
-
-#%% build data frame from CDS list
-locus_tags = []
-names = []
-products = []
-starts = []
-ends = []
-strands = []
-for feat in CDS:
-    info = feat.qualifiers
-    locus_tags.append(info['old_locus_tag'][0])
-    if 'gene' in info:
-        names.append(info['gene'][0])
-    else: names.append('')
-    products.append(info['product'][0])
-    starts.append(int(feat.location.start))
-    ends.append(int(feat.location.end))
-    strand = feat.location.strand
-    if strand == 1:
-        strand = '+'
-    else: strand = '-'
-    strands.append(strand)
-
-# now make the dataframe
-cds_df = pd.DataFrame(
-    data = {
-        'locus_tag': locus_tags,
-        'gene': names,
-        'product': products,
-        'start': starts,
-        'end': ends,
-        'strand': strands
-    }
+mode_membership, regulator_modes = eh.membership_matrix(
+    regulations,
+    cds_df.locus_tag.values,
+    by_mode=True
+)
+
+#%% head-on enrichment of every regulator
+# besides the chi-square and Fisher's exact tests, get p-values from shuffling
+#   head-on labels, which do not rely on large counts in small regulons.
+#   Set permutation_block_size to a number of neighbouring genes to shuffle
+#   together (cds_df is in chromosome order), or None to shuffle genes.
+num_permutations = 20000
+permutation_block_size = None
+permutation_blocks = None
+if permutation_block_size is not None:
+    permutation_blocks = onp.arange(cds_df.shape[0]) // permutation_block_size
+
+enrichment_df,_ = eh.enrichment_table(
+    regulator_membership,
+    regulators,
+    cds_df.headon.values,
+    num_permutations=num_permutations,
+    seed=0,
+    blocks=permutation_blocks
+)
+mode_enrichment_df,_ = eh.enrichment_table(
+    mode_membership,
+    regulator_modes,
+    cds_df.headon.values,
+    num_permutations=num_permutations,
+    seed=0,
+    blocks=permutation_blocks
 )
 
-# %% identify which genes are head-on, which are co-directional
-rtp_end = int(cds_df[cds_df.gene == 'rtp'].end)
-
-cds_df['headon'] = 0
-cds_df.loc[(cds_df['start'] > rtp_end) & (cds_df['strand'] == '+'), 'headon'] = 1
-cds_df.loc[(cds_df['start'] <= rtp_end) & (cds_df['strand'] == '-'), 'headon'] = 1
-
-#%% get specific regulons from subtiwiki info
-regulon_dict = {
-    'sigB' : regulations[regulations.regulator=="SigB"]['locus_tag'],
-    'sigV' : regulations[regulations.regulator=="SigV"]['locus_tag'],
-    'sigM' : regulations[regulations.regulator=="SigM"]['locus_tag'],
-    'sigX' : regulations[regulations.regulator=="SigX"]['locus_tag'],
-    'sigY' : regulations[regulations.regulator=="SigY"]['locus_tag'],
-    'sinR' : regulations[regulations.regulator=="SinR"]['locus_tag'],
+enrichment_df.to_csv('regulator_enrichment.csv', index=False)
+mode_enrichment_df.to_csv('regulator_mode_enrichment.csv', index=False)
+print(enrichment_df.sort_values('p_fisher').head(20))
+
+#%% regulons in Table 1, as (regulator, mode), where mode None uses all modes
+table1_regulons = {
+    'sigB' : ('SigB', None),
+    'sigV' : ('SigV', None),
+    'sigM' : ('SigM', None),
+    'sigX' : ('SigX', None),
+    'sigY' : ('SigY', None),
+    'sinR' : ('SinR', None),
     # only use genes activated by spx, to limit analysis to those genes upregulated during spx-regulated stress response
-    'spx' : regulations[(regulations.regulator=="Spx") & (regulations['mode'] == "activation")]['locus_tag'],
-    'spo0A' : regulations[regulations.regulator=="Spo0A"]['locus_tag'],
-    'lexA' : regulations[regulations.regulator=="LexA"]['locus_tag'],
+    'spx' : ('Spx', 'activation'),
+    'spo0A' : ('Spo0A', None),
+    'lexA' : ('LexA', None),
 }
 
-# %% annotate CDSs with information on whether each CDS is in each regulon
-for regulon, locus_tags in regulon_dict.items():
-    cds_df[regulon] = 0
-    cds_df.loc[cds_df.locus_tag.isin(locus_tags),regulon] = 1
-
-#%% check results of above code
-regulon_contents = {}
-for regulon in regulon_dict.keys():
-    regulon_contents[regulon] = {}
-
-    regulon_contents[regulon]['cds_df'] = len(onp.where(cds_df[regulon] == 1)[0])
-    regulon_contents[regulon]['subtiwiki'] = len(regulon_dict[regulon])
-
-pprint(regulon_contents)
-# result of above code:
-    # sigB is missing 20 from cds_df
-    # sigV is good
-    # sigM is missing 12 from cds_df
-    # sinR is good
-    # spx is missing 2 from cds_df
-    # spo0A is missing 26 from cds_df
-    # lexA is good
-
-# %%
-missing_idx = {}
-for regulon,wiki_vals in regulon_dict.items():
-
-    cds_vals = cds_df[cds_df[regulon] == 1]['locus_tag']
-    missing_idx[regulon] = onp.where(~wiki_vals.isin(cds_vals))[0]
-
-pprint(missing_idx)
-
-# %%
-for regulon,idx in missing_idx.items():
-    if len(idx) > 0:
-        missing_loci = regulon_dict[regulon].iloc[idx,]
-        print(regulon)
+table1_rows = []
+for regulon,(regulator,mode) in table1_regulons.items():
+    if mode is None:
+        row = enrichment_df[enrichment_df.regulator == regulator]
+    else:
+        row = mode_enrichment_df[
+            (mode_enrichment_df.regulator == regulator) & (mode_enrichment_df['mode'] == mode)
+        ]
+    table1_rows.append(row.assign(regulon=regulon))
+table1_df = pd.concat(table1_rows).set_index('regulon')
+
+#%% check the number of CDSs in each regulon against subtiwiki
+for regulon,(regulator,mode) in table1_regulons.items():
+    wiki_vals = regulations[regulations.regulator == regulator]
+    if mode is not None:
+        wiki_vals = wiki_vals[wiki_vals['mode'] == mode]
+    missing_loci = wiki_vals[~wiki_vals.locus_tag.isin(cds_df.locus_tag)]
+    print(regulon, 'cds_df:', table1_df.loc[regulon,['headon_in','codir_in']].sum(), 'subtiwiki:', wiki_vals.shape[0])
+    if missing_loci.shape[0] > 0:
         print(missing_loci)
 
 # missing loci are misc_RNA or other. Not CDSs.
 # additional missing in the numbers above are duplicate records
 
-#%%
-headon_regulon_dict = {}
-for regulon in regulon_dict.keys():
-    headon_regulon_dict[regulon] = cds_df.groupby(
-        ['headon', regulon]
-    ).gene.count()
-
-#%%
-headon_regulon_obs = {}
-headon_regulon_exp = {}
-headon_regulon_pvals = {}
-for regulon,counts in headon_regulon_dict.items():
-
-    headon = counts[1]
-    # check whether head-on genes have and zero counts
-    # categories with zero counts will be absent,
-    #   so supplement here with zero.
-    if not 0 in headon:
-        headon[0] = 0
-    if not 1 in headon:
-        headon[1] = 0
-
-    # check whether co-directional genes have and zero counts
-    # categories with zero counts will be absent,
-    #   so supplement here with zero.
-    codir = counts[0]
-    if not 0 in codir:
-        codir[0] = 0
-    if not 1 in codir:
-        codir[1] = 0
-
-    # make 2x2 contingency table
-    contingency_table = onp.array(
-        [headon,
-        codir]
-    )
-    headon_regulon_obs[regulon] = contingency_table
-
-    # run Chi-square test
-    chi2, p, dof, ex = stats.chi2_contingency(contingency_table)
-    headon_regulon_exp[regulon] = ex
-    headon_regulon_pvals[regulon] = p
+#%% contingency tables, laid out [[headon_not_in, headon_in], [codir_not_in, codir_in]]
+headon_regulon_obs = {
+    regulon:onp.array([[row.headon_not_in, row.headon_in], [row.codir_not_in, row.codir_in]])
+    for regulon,row in table1_df.iterrows()
+}
+headon_regulon_exp = {
+    regulon:eh.expected_counts(obs) for regulon,obs in headon_regulon_obs.items()
+}
+# chi-square test with Yates' correction, as stats.chi2_contingency
+headon_regulon_pvals = table1_df.p_chi2.to_dict()
 
 # %%
 for regulon in headon_regulon_obs:
@@ -173,6 +121,8 @@ for regulon in headon_regulon_obs:
 
 # %%
 pprint(headon_regulon_pvals)
+# permutation p-values
+pprint(table1_df.p_perm.to_dict())
 
 #%%
 headon_count = cds_df[cds_df.headon==1].shape[0]
@@ -0,0 +1,251 @@
+import numpy as onp
+import pandas as pd
+from scipy import sparse, stats
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+#%% gene x regulator membership, built once from Subtiwiki regulations
+def membership_matrix(regulations, locus_tags, by_mode=False):
+    """Sparse genes x regulators matrix, 1 where a gene is regulated by a regulator.
+
+    regulations needs regulator and locus_tag columns (and mode with
+    by_mode=True, to give each regulator/mode pair its own column). Genes
+    are the rows of locus_tags; regulated genes not in locus_tags are left
+    out. Returns the matrix and a data frame describing its columns.
+    """
+    key_columns = ['regulator','mode'] if by_mode else ['regulator']
+    gene_idx = pd.Index(locus_tags).get_indexer(regulations.locus_tag.values)
+    # duplicate records of a regulation count once
+    pairs = regulations[key_columns].assign(gene_idx=gene_idx)
+    pairs = pairs[pairs.gene_idx >= 0].drop_duplicates()
+
+    keys = regulations[key_columns].drop_duplicates().reset_index(drop=True)
+    regulator_idx = pd.MultiIndex.from_frame(keys).get_indexer(
+        pd.MultiIndex.from_frame(pairs[key_columns])
+    )
+
+    membership = sparse.csr_matrix(
+        (onp.ones(pairs.shape[0]), (pairs.gene_idx.values, regulator_idx)),
+        shape=(len(locus_tags), keys.shape[0])
+    )
+    return membership, keys
+
+def contingency_tables(membership, headon):
+    """2x2 table of head-on status by membership for every regulator.
+
+    Tables have shape (regulators, 2, 2) and the layout
+    [[headon_not_in, headon_in], [codir_not_in, codir_in]].
+    """
+    headon = onp.asarray(headon, dtype=onp.float64)
+    members = onp.asarray(membership.sum(axis=0)).ravel()
+    headon_in = membership.T @ headon
+    codir_in = members - headon_in
+    headon_not = headon.sum() - headon_in
+    codir_not = (headon.shape[0] - headon.sum()) - codir_in
+    return onp.stack(
+        [onp.stack([headon_not, headon_in], axis=-1),
+         onp.stack([codir_not, codir_in], axis=-1)],
+        axis=1
+    )
+
+#%% vectorised tests on stacks of 2x2 tables
+def expected_counts(tables):
+    row = tables.sum(axis=-1, keepdims=True)
+    col = tables.sum(axis=-2, keepdims=True)
+    return row * col / tables.sum(axis=(-2,-1), keepdims=True)
+
+def chi2_test(tables, correction=True):
+    """Chi-square statistic and p-value of each table, as stats.chi2_contingency.
+
+    With correction, Yates' continuity correction is applied. Tables with
+    an expected count of zero get nan.
+    """
+    expected = expected_counts(tables)
+    diff = tables - expected
+    if correction:
+        diff = onp.sign(diff) * onp.maximum(onp.abs(diff) - 0.5, 0)
+    with onp.errstate(divide='ignore', invalid='ignore'):
+        chi2 = (diff**2 / expected).sum(axis=(-2,-1))
+    chi2 = onp.where((expected > 0).all(axis=(-2,-1)), chi2, onp.nan)
+    return chi2, stats.chi2.sf(chi2, 1)
+
+def fisher_test(tables):
+    """Two-sided Fisher's exact test p-value of each table, as stats.fisher_exact."""
+    tables = onp.asarray(tables).astype(onp.int64)
+    a = tables[:,0,0]
+    row0 = tables[:,0].sum(axis=-1)
+    col0 = tables[:,:,0].sum(axis=-1)
+    total = tables.sum(axis=(-2,-1))
+
+    # hypergeometric probabilities over every possible top left count
+    low = onp.maximum(0, row0 + col0 - total)
+    high = onp.minimum(row0, col0)
+    support = low[:,None] + onp.arange((high - low).max() + 1)
+    in_support = support <= high[:,None]
+    pmf = stats.hypergeom.pmf(support, total[:,None], row0[:,None], col0[:,None])
+    pmf = onp.where(in_support, pmf, 0)
+    observed = stats.hypergeom.pmf(a, total, row0, col0)
+
+    # same relative tolerance for ties as scipy
+    as_extreme = pmf <= observed[:,None] * (1 + 1e-7)
+    return onp.minimum((pmf * as_extreme).sum(axis=-1), 1.0)
+
+def bh_fdr(p_values):
+    """Benjamini-Hochberg adjusted p-values; nan p-values are ignored and stay nan."""
+    p_values = onp.asarray(p_values, dtype=onp.float64)
+    q_values = onp.full(p_values.shape, onp.nan)
+    tested = onp.flatnonzero(~onp.isnan(p_values))
+    order = tested[onp.argsort(p_values[tested])]
+    ranked = p_values[order] * len(order) / onp.arange(1, len(order)+1)
+    q_values[order] = onp.minimum(onp.minimum.accumulate(ranked[::-1])[::-1], 1.0)
+    return q_values
+
+#%%
+def enrichment_table(membership, keys, headon, min_members=1, num_permutations=0, **permutation_kwargs):
+    """Head-on enrichment of every regulator in membership.
+
+    One row per column of membership with its 2x2 counts, the percent of
+    head-on and co-directional genes it regulates, chi-square (with Yates'
+    correction) and Fisher's exact test p-values and BH q-values.
+    With num_permutations, permutation_test p-values and q-values are added.
+    Regulators with fewer than min_members genes are left out.
+    """
+    tables = contingency_tables(membership, headon)
+    keep = tables[:,:,1].sum(axis=-1) >= min_members
+    tables = tables[keep]
+
+    chi2, p_chi2 = chi2_test(tables)
+    p_fisher = fisher_test(tables)
+    headon_count = tables[:,0].sum(axis=-1)
+    codir_count = tables[:,1].sum(axis=-1)
+
+    enrichment_df = keys[keep].reset_index(drop=True).assign(
+        headon_not_in = tables[:,0,0],
+        headon_in = tables[:,0,1],
+        codir_not_in = tables[:,1,0],
+        codir_in = tables[:,1,1],
+        headon_percent = tables[:,0,1] / headon_count * 100,
+        codir_percent = tables[:,1,1] / codir_count * 100,
+        chi2 = chi2,
+        p_chi2 = p_chi2,
+        q_chi2 = bh_fdr(p_chi2),
+        p_fisher = p_fisher,
+        q_fisher = bh_fdr(p_fisher),
+    )
+
+    if num_permutations:
+        p_perm, p_perm_headon = permutation_test(
+            membership[:,onp.flatnonzero(keep)],
+            headon,
+            num_permutations,
+            **permutation_kwargs
+        )
+        enrichment_df['p_perm'] = p_perm
+        enrichment_df['q_perm'] = bh_fdr(p_perm)
+        enrichment_df['p_perm_headon'] = p_perm_headon
+
+    return enrichment_df, tables
+
+#%% permutation null for head-on enrichment
+def _permuted_order(rng, num_permutations, block_starts, block_lengths):
+    # gene order of each permutation, moving whole blocks of genes
+    gene_count = block_lengths.sum()
+    block_order = onp.argsort(rng.random((num_permutations, block_starts.shape[0])), axis=1)
+    lengths = block_lengths[block_order]
+    # each gene's index is its position plus its block's shift, from where the
+    #   block starts to where it lands
+    shift = block_starts[block_order] - (onp.cumsum(lengths, axis=1) - lengths)
+    return onp.repeat(shift.ravel(), lengths.ravel()).reshape(num_permutations, gene_count) + onp.arange(gene_count)
+
+def _permutation_batch(membership, headon, num_permutations, seed, blocks):
+    rng = onp.random.default_rng(seed)
+    if blocks is None:
+        labels = rng.permuted(onp.broadcast_to(headon, (num_permutations, headon.shape[0])), axis=1)
+    else:
+        labels = headon[_permuted_order(rng, num_permutations, *blocks)]
+    # head-on members of every regulator under every permutation
+    return labels @ membership
+
+def permutation_test(membership, headon, num_permutations=10000, seed=0,
+                     batch_size=500, blocks=None, num_threads=None):
+    """Permutation p-values for head-on enrichment of every regulator.
+
+    Head-on labels are shuffled across genes, keeping the number of head-on
+    genes. With blocks, an array with the block of each gene (genes in
+    chromosome order, e.g. operons or fixed-size runs of genes), whole blocks
+    are shuffled instead so neighbouring genes stay together. Permutations
+    run in batches on num_threads threads, each batch seeded from seed, so
+    results only depend on seed and batch_size.
+
+    Returns two-sided p-values (head-on members as far from their expected
+    number as observed) and one-sided p-values for head-on enrichment.
+    """
+    membership = onp.asarray(
+        membership.toarray() if sparse.issparse(membership) else membership,
+        dtype=onp.float32
+    )
+    headon = onp.asarray(headon, dtype=onp.float32)
+    observed = headon @ membership
+    expected = membership.sum(axis=0) * headon.mean()
+
+    if blocks is not None:
+        # blocks as (start, length) of each run of genes
+        blocks = onp.asarray(blocks)
+        block_starts = onp.flatnonzero(onp.r_[True, blocks[1:] != blocks[:-1]])
+        block_lengths = onp.diff(onp.r_[block_starts, blocks.shape[0]])
+        blocks = (block_starts, block_lengths)
+
+    batch_sizes = [batch_size] * (num_permutations // batch_size)
+    if num_permutations % batch_size:
+        batch_sizes.append(num_permutations % batch_size)
+    seeds = onp.random.SeedSequence(seed).spawn(len(batch_sizes))
+
+    # float32 counts are exact, and the matrix products release the GIL
+    tol = 1e-3
+    as_extreme = onp.zeros(membership.shape[1])
+    as_enriched = onp.zeros(membership.shape[1])
+    with ThreadPoolExecutor(max_workers=num_threads or os.cpu_count()) as pool:
+        batches = pool.map(
+            lambda args: _permutation_batch(membership, headon, *args, blocks),
+            zip(batch_sizes, seeds)
+        )
+        for perm_counts in batches:
+            as_extreme += (onp.abs(perm_counts - expected) >= onp.abs(observed - expected) - tol).sum(axis=0)
+            as_enriched += (perm_counts >= observed - tol).sum(axis=0)
+
+    return (as_extreme + 1) / (num_permutations + 1), (as_enriched + 1) / (num_permutations + 1)
+
+#%% regulon summaries of posterior draws of per-gene quantities
+def posterior_regulon_effects(draws, membership, headon, chunk_size=1000):
+    """Mean of head-on and co-directional members of every regulon, for every draw.
+
+    draws is draws x genes (e.g. each gene's Gini coefficient), with genes
+    in the rows of membership. Means come from matrix products of chunk_size
+    draws at a time with the head-on and co-directional parts of membership.
+    Returns draws x regulators arrays of the head-on mean, co-directional
+    mean and their difference; nan where a regulon has no head-on or no
+    co-directional members.
+    """
+    membership = onp.asarray(
+        membership.toarray() if sparse.issparse(membership) else membership,
+        dtype=onp.float32
+    )
+    headon = onp.asarray(headon, dtype=onp.float32)[:,None]
+    # columns average over the head-on, then the co-directional members
+    weights = onp.concatenate([membership * headon, membership * (1 - headon)], axis=1)
+    with onp.errstate(divide='ignore', invalid='ignore'):
+        weights = weights / weights.sum(axis=0)
+
+    draws = onp.asarray(draws)
+    regulator_count = membership.shape[1]
+    means = onp.empty((draws.shape[0], 2*regulator_count), dtype=onp.float32)
+    for start in range(0, draws.shape[0], chunk_size):
+        means[start:start+chunk_size] = draws[start:start+chunk_size].astype(onp.float32) @ weights
+
+    headon_mean = means[:,:regulator_count]
+    codir_mean = means[:,regulator_count:]
+    return {
+        'headon_mean':headon_mean,
+        'codir_mean':codir_mean,
+        'difference':headon_mean - codir_mean,
+    }
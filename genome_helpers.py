@@ -0,0 +1,102 @@
+import numpy as onp
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from Bio import SeqIO
+import hashlib
+import os
+
+#%% CDS table parsed from a GenBank file once, cached as parquet next to it.
+#   The cache records the sha256 of the GenBank file it was parsed from and
+#   is rebuilt whenever the file changes.
+def file_sha256(path, block_size=1<<20):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def cds_cache_path(gbk_path):
+    return os.path.splitext(gbk_path)[0] + '.cds.parquet'
+
+def parse_cds_table(gbk_path):
+    """One row per CDS in gbk_path, sorted by start."""
+    refseq = SeqIO.read(gbk_path, 'genbank')
+    CDS = [feat for feat in refseq.features if feat.type == "CDS"]
+
+    cds_df = pd.DataFrame(
+        data = {
+            'locus_tag': [feat.qualifiers['old_locus_tag'][0] for feat in CDS],
+            'gene': [feat.qualifiers.get('gene', [''])[0] for feat in CDS],
+            'product': [feat.qualifiers['product'][0] for feat in CDS],
+            'start': onp.array([int(feat.location.start) for feat in CDS], dtype=onp.int32),
+            'end': onp.array([int(feat.location.end) for feat in CDS], dtype=onp.int32),
+            'strand': pd.Categorical(
+                ['+' if feat.location.strand == 1 else '-' for feat in CDS],
+                categories=['+','-']
+            ),
+        }
+    )
+    cds_df = cds_df.sort_values('start', kind='stable').reset_index(drop=True)
+    cds_df['headon'] = assign_headon(cds_df)
+    return cds_df
+
+def assign_headon(cds_df, terminus_gene='rtp'):
+    """1 for CDSs transcribed head-on to replication, 0 for co-directional.
+
+    Replication runs towards the end of terminus_gene on both arms.
+    """
+    rtp_end = int(cds_df.end.values[cds_df.gene.values == terminus_gene][0])
+    plus_strand = cds_df.strand.values == '+'
+    return onp.where(cds_df.start.values > rtp_end, plus_strand, ~plus_strand).astype(onp.int8)
+
+def load_cds_table(gbk_path, cache_path=None):
+    """CDS table of gbk_path, from the cache if it was built from the same file."""
+    if cache_path is None:
+        cache_path = cds_cache_path(gbk_path)
+    gbk_hash = file_sha256(gbk_path)
+
+    if os.path.exists(cache_path):
+        metadata = pq.read_schema(cache_path).metadata or {}
+        if metadata.get(b'gbk_sha256') == gbk_hash.encode():
+            return pd.read_parquet(cache_path)
+
+    cds_df = parse_cds_table(gbk_path)
+    table = pa.Table.from_pandas(cds_df, preserve_index=False)
+    table = table.replace_schema_metadata(
+        {**(table.schema.metadata or {}), b'gbk_sha256':gbk_hash.encode()}
+    )
+    pq.write_table(table, cache_path)
+    return cds_df
+
+#%% lookups into a CDS table sorted by start
+def locus_tag_positions(cds_df, locus_tags):
+    """Row of each locus tag in cds_df, -1 for locus tags that are not CDSs."""
+    return pd.Index(cds_df.locus_tag.values).get_indexer(locus_tags)
+
+def orientation(cds_df, locus_tags):
+    """headon for each locus tag, -1 for locus tags that are not CDSs."""
+    positions = locus_tag_positions(cds_df, locus_tags)
+    return onp.where(positions >= 0, cds_df.headon.values[positions], -1)
+
+def overlapping(cds_df, start, end):
+    """Rows of the CDSs overlapping [start, end)."""
+    starts = cds_df.start.values
+    # CDSs can be nested, so the first candidate comes from the running
+    #   maximum of the ends rather than from the ends themselves
+    max_end = onp.maximum.accumulate(cds_df.end.values)
+    first = onp.searchsorted(max_end, start, side='right')
+    last = onp.searchsorted(starts, end, side='left')
+    rows = onp.arange(first, last)
+    return rows[cds_df.end.values[rows] > start]
+
+def neighbours(cds_df, locus_tag, distance=5000):
+    """Rows of the CDSs overlapping distance bp either side of locus_tag."""
+    row = locus_tag_positions(cds_df, [locus_tag])[0]
+    if row < 0:
+        raise KeyError(locus_tag)
+    return overlapping(
+        cds_df,
+        cds_df.start.values[row] - distance,
+        cds_df.end.values[row] + distance
+    )
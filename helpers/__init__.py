@@ -0,0 +1,77 @@
+"""Helpers for fitting and summarizing the horseshoe models.
+
+Functions live in submodules that are only imported when first used, so
+`import helpers as h` stays cheap: h.batched_hpdi only needs numpy, while
+h.sample_model brings in jax and numpyro. Call h.init() before fitting or
+running any other JAX code to set up the host devices and compilation cache.
+"""
+import importlib
+import os
+
+# one host device per parallel chain
+host_device_count = 6
+
+# compiled XLA programs are saved here and reused by later processes
+#   (including shard workers) that compile the same function for the same
+#   shapes and dtypes. Set JAX_COMPILATION_CACHE_DIR to move it.
+compilation_cache_dir = os.environ.get(
+    'JAX_COMPILATION_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.jax_compilation_cache')
+)
+
+def enable_compilation_cache(cache_dir=compilation_cache_dir, min_compile_time_secs=1.0):
+    """Save compiled programs taking longer than min_compile_time_secs to compile in cache_dir."""
+    import jax
+    jax.config.update('jax_compilation_cache_dir', cache_dir)
+    jax.config.update('jax_persistent_cache_min_compile_time_secs', min_compile_time_secs)
+
+def init(platform='cpu', device_count=host_device_count, compilation_cache=True):
+    """Set the JAX platform and number of host devices, and enable the compilation cache.
+
+    Must run before JAX sets up its devices, i.e. before any JAX computation.
+    """
+    import numpyro
+    numpyro.set_platform(platform)
+    numpyro.set_host_device_count(device_count)
+    if compilation_cache:
+        enable_compilation_cache()
+
+#%% lazily imported submodules
+_submodule_names = {
+    'summaries':[
+        'batched_hpdi', 'summarize_samples', 'get_mean_and_ci', 'rereference',
+        'fast_gini', 'gini_draws', 'gini_summary',
+    ],
+    'jax_gini':['subtract_min', 'add_a_bit', 'prep_for_gini', 'gini'],
+    'models':[
+        'finnish_horseshoe', 'horseshoe_model', 'horseshoe_cell_model',
+        'horseshoe_grid_model', 'normal_model',
+    ],
+    'cells':['aggregate_cells'],
+    'convergence':['convergence_summary', 'store_convergence_summary'],
+    'storage':[
+        'write_sample_batch', 'open_sample_store', 'save_samples_npy', 'load_samples_npy',
+        'samples_npy_is_current',
+    ],
+    'sampling':[
+        'sample_model', 'add_b_condition', 'warm_up_sampler', 'sample_condition_subsets',
+        'warm_start_from_checkpoint', 'fit_svi', 'sample_model_checkpointed',
+    ],
+    'sharding':['shard_model_args', 'merge_shard_samples', 'warm_up_sharded', 'sample_model_sharded'],
+}
+_submodule_of = {
+    name:submodule for submodule,names in _submodule_names.items() for name in names
+}
+
+def __getattr__(name):
+    if name in _submodule_names:
+        return importlib.import_module('.' + name, __name__)
+    if name in _submodule_of:
+        val = getattr(importlib.import_module('.' + _submodule_of[name], __name__), name)
+        # later lookups skip __getattr__
+        globals()[name] = val
+        return val
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+def __dir__():
+    return sorted(list(globals()) + list(_submodule_names) + list(_submodule_of))
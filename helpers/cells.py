@@ -0,0 +1,49 @@
+import numpy as onp
+
+#%% sufficient statistics of the replicates in each gene/condition cell, for
+#   horseshoe_cell_model and horseshoe_grid_model
+def aggregate_cells(y_vals, gid, cid, dense=False, gene_count=None, condition_count=None):
+    """Sufficient statistics of y_vals for each observed gene/condition cell.
+
+    Returns the arguments for horseshoe_cell_model other than N, or with
+    dense=True gene x condition arrays for horseshoe_grid_model. gene_count
+    and condition_count default to one more than the largest ids.
+    """
+    y_vals = onp.asarray(y_vals, dtype=onp.float64)
+    gid = onp.asarray(gid)
+    cid = onp.asarray(cid)
+    if condition_count is None:
+        condition_count = int(cid.max()+1)
+
+    cell_keys,cell_idx = onp.unique(
+        gid.astype(onp.int64)*condition_count + cid,
+        return_inverse=True
+    )
+    cell_n = onp.bincount(cell_idx)
+    cell_sum = onp.bincount(cell_idx, weights=y_vals)
+    # sum of squares about each cell's mean, which stays accurate in float32
+    #   where the raw sum of squares of log2signal would not
+    cell_ss = onp.bincount(cell_idx, weights=(y_vals - (cell_sum/cell_n)[cell_idx])**2)
+
+    if dense:
+        if gene_count is None:
+            gene_count = int(gid.max()+1)
+        cell_dict = {'variance':y_vals.var()}
+        for key,val in [('cell_n',cell_n),('cell_sum',cell_sum),('cell_ss',cell_ss)]:
+            # unobserved cells have no y_vals, so contribute nothing to the likelihood
+            grid = onp.zeros(gene_count*condition_count, dtype=val.dtype)
+            grid[cell_keys] = val
+            cell_dict[key] = grid.reshape(gene_count, condition_count)
+        return cell_dict
+
+    cell_dict = {
+        'cell_gid':cell_keys // condition_count,
+        'cell_cid':cell_keys % condition_count,
+        'cell_n':cell_n,
+        'cell_sum':cell_sum,
+        'cell_ss':cell_ss,
+        'variance':y_vals.var(),
+        'condition_count':condition_count
+    }
+
+    return cell_dict
@@ -0,0 +1,53 @@
+import numpy as onp
+import pandas as pd
+
+from numpyro.diagnostics import split_gelman_rubin, effective_sample_size
+
+#%% R-hat and ESS per parameter
+def _convergence_row(param, r_hat, n_eff, r_hat_threshold):
+    return {
+        'param':param,
+        'size':r_hat.size,
+        'max_r_hat':onp.nanmax(r_hat),
+        'n_over_r_hat_threshold':int(onp.sum(r_hat > r_hat_threshold)),
+        'min_n_eff':onp.nanmin(n_eff),
+        'median_n_eff':onp.nanmedian(n_eff),
+    }
+
+def convergence_summary(grouped_samples, r_hat_threshold=1.01):
+    """Summarize R-hat and ESS per parameter from samples grouped by chain."""
+    rows = []
+    for param,x in grouped_samples.items():
+        x = onp.asarray(x)
+        r_hat = onp.asarray(split_gelman_rubin(x))
+        n_eff = onp.asarray(effective_sample_size(x))
+        rows.append(_convergence_row(param, r_hat, n_eff, r_hat_threshold))
+
+    return pd.DataFrame(rows).set_index('param')
+
+def store_convergence_summary(store, r_hat_threshold=1.01, chunk_size=100):
+    """Summarize R-hat and ESS per parameter in store, reading chunk_size genes at a time."""
+    rows = []
+    for param,dset in store.items():
+        num_chains = dset.attrs['num_chains']
+        if dset.ndim == 1:
+            chunks = [()]
+        else:
+            chunks = [(slice(i, i+chunk_size),) for i in range(0, dset.shape[1], chunk_size)]
+
+        r_hat = []
+        n_eff = []
+        for chunk in chunks:
+            x = dset[(slice(None),) + chunk]
+            x = x.reshape((num_chains, -1) + x.shape[1:])
+            r_hat.append(onp.asarray(split_gelman_rubin(x)).ravel())
+            n_eff.append(onp.asarray(effective_sample_size(x)).ravel())
+
+        rows.append(_convergence_row(
+            param,
+            onp.concatenate(r_hat),
+            onp.concatenate(n_eff),
+            r_hat_threshold
+        ))
+
+    return pd.DataFrame(rows).set_index('param')
@@ -0,0 +1,29 @@
+import jax
+import jax.numpy as np
+
+#%% jitted Gini coefficient of each row, compiled for each input shape
+def subtract_min(x):
+    y = x - np.amin(x)
+    return(y)
+
+def add_a_bit(x):
+    y = x + 0.0000001 #values for Gini calculation cannot be 0
+    return(y)
+
+def prep_for_gini(x):
+    y = subtract_min(x)
+    z = add_a_bit(y)
+    return(z)
+
+prep_for_gini = jax.jit(jax.vmap(prep_for_gini, in_axes=0, out_axes=0))
+
+def gini(array):
+    """Calculate the Gini coefficient of a numpy array."""
+    # based on bottom eq: http://www.statsdirect.com/help/content/image/stat0206_wmf.gif
+    # from: http://www.statsdirect.com/help/default.htm#nonparametric_methods/gini.htm
+    array = np.sort(array) #values must be sorted
+    index = np.arange(1,array.shape[0]+1) #index per array element
+    n = array.shape[0]#number of array elements
+    return ((np.sum((2 * index - n  - 1) * array)) / (n * np.sum(array))) #Gini coefficient
+
+gini = jax.jit(jax.vmap(gini, in_axes=0, out_axes=0))
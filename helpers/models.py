@@ -0,0 +1,232 @@
+import jax.numpy as np
+
+import numpyro
+import numpyro.distributions as dist
+
+#%% set up for finnish horseshoe in (Piironen, J., and Vehtari, A., 2017)
+def finnish_horseshoe(M, m0, N, var, half_slab_df, slab_scale2, tau_tilde, c2_tilde, lambd, beta_tilde):
+
+    tau0 = (m0/(M-m0) * (np.sqrt(var)/np.sqrt(1.0*N)))
+    tau = tau0 * tau_tilde
+    c2 = slab_scale2 * c2_tilde
+    lambd_tilde = np.sqrt(c2 * lambd**2 / (c2 + tau**2 + lambd**2))
+
+    beta = tau * lambd_tilde * beta_tilde
+
+    return(beta)
+
+def _gene_N(N, gene_idx=None):
+    # N is the same for all genes, or an array with each gene's N, which
+    #   is lined up with per-gene parameters of shape (genes, 1)
+    if np.ndim(N) == 0:
+        return N
+    N = np.asarray(N)
+    if gene_idx is not None:
+        N = N[gene_idx]
+    return N.reshape((-1,1))
+
+def horseshoe_model(y_vals,
+                    gid,
+                    cid,
+                    N, # array of number of y_vals in each gene
+                    slab_df=1,
+                    slab_scale=1,
+                    expected_large_covar_num=5, # expected large covar num here is the prior on the number of conditions we expect to affect expression of a given gene
+                    condition_intercept=False,
+                    variance=None, # variance of all y_vals; pass it in when fitting a subset of genes so the prior matches the full fit
+                    condition_count=None): 
+
+    gene_count = gid.max()+1
+    if condition_count is None:
+        condition_count = cid.max()+1
+
+    # separate regularizing prior on intercept for each gene
+    a_prior = dist.Normal(10., 10.)
+    a = numpyro.sample("alpha", a_prior, sample_shape=(gene_count,))
+
+    # implement Finnish horseshoe
+    half_slab_df = slab_df/2
+    if variance is None:
+        variance = y_vals.var()
+    slab_scale2 = slab_scale**2
+    hs_shape = (gene_count, condition_count)
+
+    # set up "local" horseshoe priors for each gene and condition
+    beta_tilde = numpyro.sample('beta_tilde', dist.Normal(0., 1.), sample_shape=hs_shape) # beta_tilde contains betas for all hs parameters
+    lambd = numpyro.sample('lambd', dist.HalfCauchy(1.), sample_shape=hs_shape) # lambd contains lambda for each hs covariate
+    # set up global hyperpriors.
+    # each gene gets its own hyperprior for regularization of large effects to keep the sampling from wandering unfettered from 0.
+    tau_tilde = numpyro.sample('tau_tilde', dist.HalfCauchy(1.), sample_shape=(gene_count,1))
+    c2_tilde = numpyro.sample('c2_tilde', dist.InverseGamma(half_slab_df, half_slab_df), sample_shape=(gene_count,1))
+
+    bC = finnish_horseshoe(M = hs_shape[1], # total number of conditions
+                            m0 = expected_large_covar_num, # number of condition we expect to affect expression of a given gene
+                            N = _gene_N(N), # number of observations for the gene
+                            var = variance,
+                            half_slab_df = half_slab_df,
+                            slab_scale2 = slab_scale2,
+                            tau_tilde = tau_tilde,
+                            c2_tilde = c2_tilde,
+                            lambd = lambd,
+                            beta_tilde = beta_tilde)
+    numpyro.sample("b_condition", dist.Delta(bC), obs=bC)
+    
+    if condition_intercept:
+        a_C_prior = dist.Normal(0., 1.)
+        a_C = numpyro.sample('a_condition', a_C_prior, sample_shape=(condition_count,))
+
+        mu = a[gid] + a_C[cid] + bC[gid,cid]
+
+    else:
+        # calculate implied log2(signal) for each gene/condition
+        #   by adding each gene's intercept (a) to each of that gene's
+        #   condition effects (bC).
+        mu = a[gid] + bC[gid,cid]
+
+    sig_prior = dist.Exponential(1.)
+    sigma = numpyro.sample('sigma', sig_prior)
+    return numpyro.sample('obs', dist.Normal(mu, sigma), obs=y_vals)
+
+#%% horseshoe model over observed gene/condition cells only
+def horseshoe_cell_model(cell_gid,
+                         cell_cid,
+                         cell_n, # number of y_vals in each cell
+                         cell_sum, # sum of y_vals in each cell
+                         cell_ss, # sum of squares of y_vals about each cell's mean
+                         N, # array of number of y_vals in each gene
+                         variance, # variance of all y_vals
+                         condition_count,
+                         slab_df=1,
+                         slab_scale=1,
+                         expected_large_covar_num=5,
+                         condition_intercept=False):
+
+    # same model as horseshoe_model, but beta_tilde and lambd only exist for
+    #   observed cells, and replicates are combined through each cell's
+    #   sufficient statistics.
+    gene_count = cell_gid.max()+1
+    cell_count = cell_gid.shape[0]
+
+    a_prior = dist.Normal(10., 10.)
+    a = numpyro.sample("alpha", a_prior, sample_shape=(gene_count,))
+
+    half_slab_df = slab_df/2
+    slab_scale2 = slab_scale**2
+
+    beta_tilde = numpyro.sample('beta_tilde', dist.Normal(0., 1.), sample_shape=(cell_count,))
+    lambd = numpyro.sample('lambd', dist.HalfCauchy(1.), sample_shape=(cell_count,))
+    tau_tilde = numpyro.sample('tau_tilde', dist.HalfCauchy(1.), sample_shape=(gene_count,1))
+    c2_tilde = numpyro.sample('c2_tilde', dist.InverseGamma(half_slab_df, half_slab_df), sample_shape=(gene_count,1))
+
+    # N of each cell's gene
+    cell_N = N if np.ndim(N) == 0 else np.asarray(N)[cell_gid]
+    bC_cells = finnish_horseshoe(M = condition_count,
+                                 m0 = expected_large_covar_num,
+                                 N = cell_N,
+                                 var = variance,
+                                 half_slab_df = half_slab_df,
+                                 slab_scale2 = slab_scale2,
+                                 tau_tilde = tau_tilde[cell_gid,0],
+                                 c2_tilde = c2_tilde[cell_gid,0],
+                                 lambd = lambd,
+                                 beta_tilde = beta_tilde)
+    # keep b_condition in the gene x condition layout of horseshoe_model
+    bC = np.zeros((gene_count, condition_count)).at[cell_gid,cell_cid].set(bC_cells)
+    numpyro.sample("b_condition", dist.Delta(bC), obs=bC)
+
+    if condition_intercept:
+        a_C_prior = dist.Normal(0., 1.)
+        a_C = numpyro.sample('a_condition', a_C_prior, sample_shape=(condition_count,))
+
+        mu = a[cell_gid] + a_C[cell_cid] + bC_cells
+
+    else:
+        mu = a[cell_gid] + bC_cells
+
+    sig_prior = dist.Exponential(1.)
+    sigma = numpyro.sample('sigma', sig_prior)
+
+    # Normal log likelihood of all y_vals in each cell, from
+    #   sum((y - mu)**2) = cell_ss + cell_n*(cell_mean - mu)**2
+    cell_mean = cell_sum / cell_n
+    log_lik = (
+        -cell_n * (np.log(sigma) + 0.5*np.log(2*np.pi))
+        - (cell_ss + cell_n*(cell_mean - mu)**2) / (2*sigma**2)
+    )
+    return numpyro.factor('obs', log_lik.sum())
+
+def horseshoe_grid_model(cell_n,
+                         cell_sum,
+                         cell_ss,
+                         N,
+                         variance,
+                         gene_batch_size=None, # number of genes in each minibatch, None uses all genes
+                         slab_df=1,
+                         slab_scale=1,
+                         expected_large_covar_num=5):
+
+    # horseshoe_cell_model on dense gene x condition arrays of cell statistics
+    #   (see aggregate_cells(..., dense=True)), with genes in a plate so SVI
+    #   can subsample them. alpha has shape (genes, 1) here.
+    gene_count,condition_count = cell_n.shape
+    half_slab_df = slab_df/2
+    slab_scale2 = slab_scale**2
+    # subsampled genes are indexed inside jit, so these must be jax arrays
+    cell_n,cell_sum,cell_ss = np.asarray(cell_n),np.asarray(cell_sum),np.asarray(cell_ss)
+
+    sig_prior = dist.Exponential(1.)
+    sigma = numpyro.sample('sigma', sig_prior)
+
+    with numpyro.plate('genes', gene_count, subsample_size=gene_batch_size, dim=-2) as idx:
+        a = numpyro.sample("alpha", dist.Normal(10., 10.))
+        tau_tilde = numpyro.sample('tau_tilde', dist.HalfCauchy(1.))
+        c2_tilde = numpyro.sample('c2_tilde', dist.InverseGamma(half_slab_df, half_slab_df))
+
+        with numpyro.plate('conditions', condition_count, dim=-1):
+            beta_tilde = numpyro.sample('beta_tilde', dist.Normal(0., 1.))
+            lambd = numpyro.sample('lambd', dist.HalfCauchy(1.))
+
+            bC = finnish_horseshoe(M = condition_count,
+                                   m0 = expected_large_covar_num,
+                                   N = _gene_N(N, idx),
+                                   var = variance,
+                                   half_slab_df = half_slab_df,
+                                   slab_scale2 = slab_scale2,
+                                   tau_tilde = tau_tilde,
+                                   c2_tilde = c2_tilde,
+                                   lambd = lambd,
+                                   beta_tilde = beta_tilde)
+            numpyro.sample("b_condition", dist.Delta(bC), obs=bC)
+
+            n = cell_n[idx]
+            mu = a + bC
+            cell_mean = np.where(n > 0, cell_sum[idx] / np.maximum(n, 1), mu)
+            log_lik = (
+                -n * (np.log(sigma) + 0.5*np.log(2*np.pi))
+                - (cell_ss[idx] + n*(cell_mean - mu)**2) / (2*sigma**2)
+            )
+            # scaled up by gene_count/gene_batch_size when genes are subsampled
+            return numpyro.factor('obs', log_lik)
+
+def normal_model(y_vals,
+                              gid,
+                              cid):
+
+    gene_count = gid.max()+1
+    condition_count = cid.max()+1
+
+    a_prior = dist.Normal(10., 10.)
+    a = numpyro.sample("alpha", a_prior, sample_shape=(gene_count,))
+
+    a_cond_prior = dist.Normal(0., 5.)
+    a_cond = numpyro.sample("a_cond", a_cond_prior, sample_shape=(condition_count,))
+
+    b_shape = (gene_count, condition_count)
+    bC_prior = dist.Normal(0., 1.)
+    bC = numpyro.sample('b_condition', bC_prior, sample_shape=b_shape)
+    
+    mu = a[gid] + a_cond[cid] + bC[gid,cid]
+
+    sig_prior = dist.Exponential(1.)
+    sigma = numpyro.sample('sigma', sig_prior)
+    return numpyro.sample('obs', dist.Normal(mu, sigma), obs=y_vals)
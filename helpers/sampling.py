@@ -0,0 +1,612 @@
+import numpy as onp
+
+import functools
+import os
+import warnings
+
+import jax
+import jax.numpy as np
+import jax.random as random
+
+import numpyro
+from numpyro.infer import MCMC, NUTS, Predictive, SVI, Trace_ELBO
+from numpyro.infer.autoguide import AutoNormal
+
+from .convergence import convergence_summary, store_convergence_summary
+from .storage import _dump_pickle, _load_pickle, write_sample_batch, open_sample_store
+
+#%% NUTS
+def sample_model(rng_key,
+                 model,
+                 model_args_dict,
+                 num_warmup=500,
+                 num_samples=500,
+                 num_chains=1,
+                 chain_method='sequential',
+                 print_summary=False,
+                 warm_start=None,
+                 last_state_path=None,
+                 progress_bar=True):
+
+    # None runs one chain per host device
+    if num_chains is None:
+        num_chains = jax.local_device_count()
+
+    # warm_start from warm_start_from_checkpoint sets the initial step size,
+    #   mass matrix and parameter values
+    if warm_start is None:
+        kernel = NUTS(model)
+        init_params = None
+    else:
+        kernel = _warm_start_kernel(model, warm_start)
+        chain_params = _chain_init_params(warm_start, num_chains, rng_key)
+        if num_chains == 1:
+            init_params = chain_params[0]
+        else:
+            init_params = {k:np.stack([p[k] for p in chain_params]) for k in chain_params[0]}
+
+    mcmc = MCMC(
+        kernel,
+        num_warmup=num_warmup,
+        num_samples=num_samples,
+        num_chains=num_chains,
+        chain_method=chain_method,
+        progress_bar=progress_bar
+    )
+
+    mcmc.run(
+        rng_key,
+        extra_fields=('diverging',),
+        init_params=init_params,
+        **model_args_dict
+    )
+
+    # save the last state like a checkpoint, to warm start a later refit
+    if last_state_path is not None:
+        _dump_pickle(
+            {'last_state':jax.device_get(mcmc.last_state), 'iteration':num_warmup+num_samples},
+            last_state_path
+        )
+
+    # the full table has a row for every gene x condition,
+    #   so by default only print the worst R-hat and ESS per parameter
+    if print_summary:
+        mcmc.print_summary()
+    else:
+        print(convergence_summary(mcmc.get_samples(group_by_chain=True)))
+    divergences = mcmc.get_extra_fields()["diverging"]
+    print('Number of divergences: {}'.format(int(divergences.sum())))
+
+    # chains are merged along the sample axis
+    samples = mcmc.get_samples()
+    samples = add_b_condition(rng_key, model, samples, model_args_dict)
+
+    return samples
+
+def add_b_condition(rng_key, model, samples, model_args_dict):
+    """Add b_condition to samples for models that only observe it."""
+    if not 'b_condition' in samples:
+        bC = Predictive(
+                model,
+                samples,
+                return_sites=['b_condition']
+            )(
+                rng_key,
+                **model_args_dict
+            )['b_condition']
+
+        samples['b_condition'] = bC
+
+    return samples
+
+#%% fitting subsets of conditions
+def _static_args(model_args_dict):
+    # ints like gene_count and condition_count set the shapes in the model,
+    #   so are bound to it rather than passed in as jitted arguments
+    return {
+        k:int(val) for k,val in model_args_dict.items()
+        if isinstance(val, (int, onp.integer))
+    }
+
+def sample_condition_subsets(rng_key,
+                             model,
+                             subset_args,
+                             num_warmup=500,
+                             num_samples=500,
+                             num_chains=1,
+                             chain_method='sequential',
+                             keep_params=('alpha','b_condition','sigma'),
+                             progress_bar=True):
+    """Sample model for each model_args_dict in subset_args, a dict of subset name to arguments.
+
+    Subsets whose arguments have the same shapes reuse one MCMC, which
+    compiles the sampler with the array arguments as inputs, so only the
+    first of them compiles. Int arguments are bound to the model, as they
+    can set shapes. With horseshoe_grid_model and
+    design_helpers.condition_subset_args, shapes only depend on the numbers
+    of genes and conditions. Returns a dict of subset name to samples, with
+    alpha as genes rather than genes x 1 for horseshoe_grid_model.
+    Only samplers run without progress_bar go in the compilation cache, so
+    reruns in a new process load them instead of compiling.
+    """
+    if num_chains is None:
+        num_chains = jax.local_device_count()
+
+    mcmc_by_shape = {}
+    subset_samples = {}
+    for subset_idx,(name,model_args_dict) in enumerate(subset_args.items()):
+        static_args = _static_args(model_args_dict)
+        array_args = {k:val for k,val in model_args_dict.items() if not k in static_args}
+        shape_key = (
+            tuple(sorted(static_args.items())),
+            tuple((k, np.shape(val), np.result_type(val).name) for k,val in sorted(array_args.items()))
+        )
+
+        if not shape_key in mcmc_by_shape:
+            mcmc_by_shape[shape_key] = MCMC(
+                NUTS(functools.partial(model, **static_args)),
+                num_warmup=num_warmup,
+                num_samples=num_samples,
+                num_chains=num_chains,
+                chain_method=chain_method,
+                progress_bar=progress_bar,
+                jit_model_args=True
+            )
+        else:
+            print('Reusing the compiled sampler for {}'.format(name))
+        mcmc = mcmc_by_shape[shape_key]
+
+        subset_key = random.fold_in(rng_key, subset_idx)
+        mcmc.run(subset_key, extra_fields=('diverging',), **array_args)
+
+        print(name)
+        print(convergence_summary(mcmc.get_samples(group_by_chain=True)))
+        print('Number of divergences: {}'.format(int(mcmc.get_extra_fields()["diverging"].sum())))
+
+        samples = add_b_condition(subset_key, model, mcmc.get_samples(), model_args_dict)
+        samples = {k:onp.asarray(samples[k]) for k in keep_params}
+        # horseshoe_grid_model samples alpha with a trailing condition axis of 1
+        if 'alpha' in samples and samples['alpha'].ndim == 3:
+            samples['alpha'] = samples['alpha'][...,0]
+        subset_samples[name] = samples
+
+    return subset_samples
+
+#%% warm starting a refit after genes or conditions are added
+def _latent_shapes(model, model_args_dict):
+    # shapes of the latent sample sites of model for model_args_dict.
+    #   Tracing abstractly never evaluates (possibly invalid) prior draws.
+    def latent_values():
+        model_trace = numpyro.handlers.trace(
+            numpyro.handlers.seed(model, random.PRNGKey(0))
+        ).get_trace(**model_args_dict)
+
+        return {
+            name:site['value'] for name,site in model_trace.items()
+            if site['type'] == 'sample' and not site['is_observed']
+        }
+
+    return {k:val.shape for k,val in jax.eval_shape(latent_values).items()}
+
+def _expand_block(x, new_shape):
+    # put x in the leading corner of an array of new_shape. New genes and
+    #   conditions get the next ids, so old entries keep their positions.
+    #   New entries start at the mean of the old ones.
+    x = onp.asarray(x)
+    if x.shape == tuple(new_shape):
+        return x
+    expanded = onp.full(new_shape, x.mean() if x.size else 0., dtype=x.dtype)
+    expanded[tuple(slice(0,n) for n in x.shape)] = x
+    return expanded
+
+def _warm_start_kernel(model, warm_start):
+    # keep the previous fit's mass matrix and only adapt the step size; a
+    #   short re-warmup would replace the matrix with a noisy estimate from
+    #   its first few dozen draws
+    return NUTS(
+        model,
+        step_size=warm_start['step_size'],
+        inverse_mass_matrix=warm_start['inverse_mass_matrix'],
+        adapt_mass_matrix=False
+    )
+
+def _chain_init_params(warm_start, num_chains, rng_key):
+    # chain c starts where chain c of the previous fit stopped. Chains beyond
+    #   the previous fit's reuse its chains, jittered by the posterior sd of
+    #   each parameter, so no two chains start at the same point.
+    init_params = warm_start['init_params']
+    previous_chains = next(iter(init_params.values())).shape[0]
+    rng = onp.random.default_rng(onp.asarray(random.key_data(rng_key)).tolist())
+
+    chain_params = []
+    for chain in range(num_chains):
+        params = {k:val[chain % previous_chains] for k,val in init_params.items()}
+        if chain >= previous_chains:
+            params = {
+                k:(val + warm_start['init_scale'][k]*rng.standard_normal(val.shape)).astype(val.dtype)
+                for k,val in params.items()
+            }
+        chain_params.append(params)
+    return chain_params
+
+def warm_start_from_checkpoint(state_path, model, model_args_dict):
+    """Step size, mass matrix and parameter values from a previous fit, expanded to model_args_dict.
+
+    state_path is a checkpoint's mcmc_state.pkl or a sample_model last_state_path.
+    Parameters must be laid out by gene and condition id, as in horseshoe_model;
+    horseshoe_cell_model raises ValueError, as its cells move when conditions are added.
+    """
+    if 'cell_gid' in model_args_dict:
+        raise ValueError(
+            "Can't warm start a model with parameters per observed cell; "
+            "use horseshoe_model, whose parameters are laid out by gene and condition id"
+        )
+
+    state = _load_pickle(state_path)['last_state']
+    # parameter values of every chain, the step size and mass matrix of the first
+    if onp.ndim(state.i) == 0:
+        state = jax.tree_util.tree_map(lambda x: onp.asarray(x)[None], state)
+    adapt_state = jax.tree_util.tree_map(lambda x: x[0], state.adapt_state)
+
+    new_shapes = _latent_shapes(model, model_args_dict)
+    old_shapes = {k:onp.shape(val)[1:] for k,val in state.z.items()}
+
+    # parameter values, in unconstrained space as MCMC.run expects
+    init_params = {
+        k:onp.stack([_expand_block(z, new_shapes[k]) for z in state.z[k]]) for k in new_shapes
+    }
+
+    # the diagonal inverse mass matrix is the flattened sites stacked in order,
+    #   and holds each parameter's posterior variance
+    site_variance = {}
+    def expand_flat(flat, sites):
+        start = 0
+        for site in sites:
+            size = int(onp.prod(old_shapes[site]))
+            block = onp.asarray(flat[start:start+size]).reshape(old_shapes[site])
+            site_variance[site] = _expand_block(block, new_shapes[site])
+            start += size
+        return onp.concatenate([site_variance[site].ravel() for site in sites])
+
+    inverse_mass_matrix = adapt_state.inverse_mass_matrix
+    if isinstance(inverse_mass_matrix, dict):
+        inverse_mass_matrix = {
+            sites:expand_flat(flat, sites) for sites,flat in inverse_mass_matrix.items()
+        }
+    else:
+        inverse_mass_matrix = expand_flat(inverse_mass_matrix, sorted(old_shapes))
+
+    warm_start = {
+        'init_params':init_params,
+        'init_scale':{k:onp.sqrt(val) for k,val in site_variance.items()},
+        'step_size':float(adapt_state.step_size),
+        'inverse_mass_matrix':inverse_mass_matrix
+    }
+
+    return warm_start
+
+#%% variational inference
+def fit_svi(rng_key,
+            model,
+            model_args_dict,
+            num_steps=5000,
+            num_samples=500,
+            learning_rate=0.01,
+            guide=None,
+            keep_params=('alpha','b_condition','sigma')):
+    """Fit model by SVI and draw num_samples from the fitted guide, laid out as from sample_model.
+
+    guide defaults to AutoNormal. Set gene_batch_size in model_args_dict to
+    minibatch genes in horseshoe_grid_model; draws always cover all genes.
+    """
+    if guide is None:
+        guide = AutoNormal(model)
+
+    svi = SVI(model, guide, numpyro.optim.Adam(learning_rate), Trace_ELBO())
+    rng_key, pred_key = random.split(rng_key)
+    svi_result = svi.run(rng_key, num_steps, **model_args_dict)
+
+    # draw latents for all genes from the fitted guide, then run them through
+    #   the model without subsampling to get deterministic sites like b_condition
+    guide_key, pred_key = random.split(pred_key)
+    posterior = guide.sample_posterior(
+        guide_key,
+        svi_result.params,
+        sample_shape=(num_samples,)
+    )
+    predict_args = dict(model_args_dict)
+    if 'gene_batch_size' in predict_args:
+        predict_args['gene_batch_size'] = None
+    samples = Predictive(
+        model,
+        posterior,
+        return_sites=list(keep_params)
+    )(
+        pred_key,
+        **predict_args
+    )
+
+    samples = {k:onp.asarray(val) for k,val in samples.items()}
+    # horseshoe_grid_model samples alpha with a trailing condition axis of 1
+    if samples['alpha'].ndim == 3:
+        samples['alpha'] = samples['alpha'][...,0]
+    print('Final loss: {}'.format(float(svi_result.losses[-1])))
+
+    return samples
+
+#%% checkpointed sampling
+# batches of iterations run through one compiled program per batch length,
+#   built from the kernel's public sample and postprocess_fn, so the
+#   programs can be compiled ahead of a fit (see warm_up_sampler)
+def _chain_method(num_chains, chain_method):
+    # like numpyro, run parallel chains sequentially without enough devices
+    if num_chains > 1 and chain_method == 'parallel' and jax.local_device_count() < num_chains:
+        warnings.warn(
+            'There are not enough devices to run parallel chains: expected {} but got {}. '
+            'Chains will be drawn sequentially.'.format(num_chains, jax.local_device_count())
+        )
+        return 'sequential'
+    return chain_method
+
+def _init_checkpointed(rng_key, model, model_args_dict, num_warmup, num_chains, warm_start, init_state=True):
+    # the kernel, the key for the batches and, with init_state, the initial
+    #   state of all chains on the host, as a checkpoint holds it. Without
+    #   init_state, the shapes and dtypes of that state instead.
+    # initializing the kernel sets up its adaptation schedule for num_warmup
+    #   iterations, so warmup keeps adapting across runs started from a
+    #   saved state until state.i reaches num_warmup.
+    if warm_start is None:
+        kernel = NUTS(model)
+        chain_params = [None]*num_chains
+    else:
+        kernel = _warm_start_kernel(model, warm_start)
+        chain_params = _chain_init_params(warm_start, num_chains, rng_key)
+    init_keys = random.split(rng_key, num_chains+1)
+
+    if not init_state:
+        state = jax.device_get(
+            kernel.init(init_keys[1], num_warmup, init_params=chain_params[0], model_kwargs=model_args_dict)
+        )
+        chain_shape = () if num_chains == 1 else (num_chains,)
+        state_shapes = jax.tree_util.tree_map(
+            lambda x: jax.ShapeDtypeStruct(chain_shape + onp.shape(x), onp.asarray(x).dtype), state
+        )
+        return kernel, init_keys[0], state_shapes
+
+    init_states = [
+        kernel.init(key, num_warmup, init_params=params, model_kwargs=model_args_dict)
+        for key,params in zip(init_keys[1:], chain_params)
+    ]
+    if num_chains == 1:
+        init_state = init_states[0]
+    else:
+        init_state = jax.tree_util.tree_map(lambda *x: np.stack(x), *init_states)
+    return kernel, init_keys[0], jax.device_get(init_state)
+
+def _batch_length(iteration, num_warmup, num_samples, checkpoint_every):
+    # don't let a batch straddle the end of warmup
+    if iteration < num_warmup:
+        return min(checkpoint_every, num_warmup-iteration)
+    return min(checkpoint_every, num_warmup+num_samples-iteration)
+
+def _check_checkpoint_settings(checkpoint, settings, state_path):
+    # a resumed fit must continue the run that wrote the checkpoint
+    saved = checkpoint.get('settings')
+    if saved is None:
+        raise ValueError('{} has no saved fit settings to check against; delete it to start a fresh fit'.format(state_path))
+    changed = sorted(k for k in settings if saved.get(k) != settings[k])
+    if changed:
+        raise ValueError(
+            '{} was written by a fit with different settings ({}); '
+            'rerun with the settings below or delete the checkpoint directory to start a fresh fit:\n{}'.format(
+                state_path,
+                ', '.join(changed),
+                '\n'.join('{}: {} (now {})'.format(k, saved.get(k), settings[k]) for k in changed)
+            )
+        )
+
+def _batch_programs(num_warmup, num_samples, checkpoint_every):
+    # (batch_length, collect) of every batch of a fit; only batches after
+    #   warmup collect samples
+    batch_starts = (
+        list(range(0, num_warmup, checkpoint_every))
+        + list(range(num_warmup, num_warmup+num_samples, checkpoint_every))
+    )
+    return {
+        (_batch_length(iteration, num_warmup, num_samples, checkpoint_every), iteration >= num_warmup)
+        for iteration in batch_starts
+    }
+
+def _batch_program(kernel, model_args_dict, batch_length, collect, num_chains, chain_method):
+    # batch_length iterations of kernel from a state, returning the last state
+    #   and each iteration's diverging flag and, with collect, parameter values.
+    #   The data are constants of the program, as in MCMC. Sequential chains
+    #   each run through the same one-chain program.
+    postprocess = kernel.postprocess_fn((), model_args_dict)
+
+    def run_batch(state):
+        def step(state, _):
+            state = kernel.sample(state, (), model_args_dict)
+            return state, (postprocess(state.z) if collect else {}, state.diverging)
+        return jax.lax.scan(step, state, None, length=batch_length)
+
+    if num_chains > 1 and chain_method == 'parallel':
+        return jax.pmap(run_batch)
+    if num_chains > 1 and chain_method == 'vectorized':
+        return jax.jit(jax.vmap(run_batch))
+    return jax.jit(run_batch)
+
+def _run_batch(program, state, num_chains, chain_method):
+    if num_chains > 1 and chain_method == 'sequential':
+        outs = [
+            jax.device_get(program(jax.tree_util.tree_map(lambda x: x[chain], state)))
+            for chain in range(num_chains)
+        ]
+        return jax.tree_util.tree_map(lambda *x: onp.stack(x), *outs)
+    return jax.device_get(program(state))
+
+#%% compiling ahead of a fit, to fill the compilation cache
+def warm_up_sampler(rng_key,
+                    model,
+                    model_args_dict,
+                    num_warmup=500,
+                    num_samples=500,
+                    checkpoint_every=100,
+                    num_chains=1,
+                    chain_method='sequential',
+                    warm_start=None):
+    """Compile the batches of a sample_model_checkpointed run without sampling.
+
+    Sets up the kernel as sample_model_checkpointed does with the same
+    arguments, then lowers and compiles the program of each kind of batch
+    that fit runs, for the shapes of its state. With the compilation cache
+    enabled, the fit then loads those programs instead of compiling them.
+    """
+    if num_chains is None:
+        num_chains = jax.local_device_count()
+    chain_method = _chain_method(num_chains, chain_method)
+
+    kernel, _, state_shapes = _init_checkpointed(
+        rng_key, model, model_args_dict, num_warmup, num_chains, warm_start, init_state=False
+    )
+    if num_chains > 1 and chain_method == 'sequential':
+        state_shapes = jax.tree_util.tree_map(
+            lambda x: jax.ShapeDtypeStruct(x.shape[1:], x.dtype), state_shapes
+        )
+    for batch_length,collect in sorted(_batch_programs(num_warmup, num_samples, checkpoint_every)):
+        _batch_program(
+            kernel, model_args_dict, batch_length, collect, num_chains, chain_method
+        ).lower(state_shapes).compile()
+
+def sample_model_checkpointed(rng_key,
+                              model,
+                              model_args_dict,
+                              checkpoint_dir,
+                              num_warmup=500,
+                              num_samples=500,
+                              num_chains=1,
+                              chain_method='sequential',
+                              checkpoint_every=100,
+                              keep_params=('alpha','b_condition','sigma'),
+                              sample_store=None,
+                              warm_start=None):
+    """Sample model checkpointing to checkpoint_dir every checkpoint_every iterations.
+
+    Rerunning with the same checkpoint_dir resumes from the last checkpoint.
+    warm_start (see warm_start_from_checkpoint) sets the initial step size,
+    mass matrix and parameter values of a new run. If sample_store is a
+    path, sample batches are streamed into that store instead of being kept
+    in memory, and the opened store is returned. A fresh run (no checkpoint
+    in checkpoint_dir) replaces any existing store at that path. Resuming
+    raises ValueError if num_warmup, num_samples, num_chains, checkpoint_every
+    or the shapes of the model's parameters differ from the checkpoint's.
+    Progress is printed after each batch. The batches' compiled programs
+    can be saved in the compilation cache ahead of the fit by warm_up_sampler.
+    """
+    if num_chains is None:
+        num_chains = jax.local_device_count()
+    chain_method = _chain_method(num_chains, chain_method)
+
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    state_path = os.path.join(checkpoint_dir, 'mcmc_state.pkl')
+
+    resuming = os.path.exists(state_path)
+    settings = {
+        'num_warmup':num_warmup,
+        'num_samples':num_samples,
+        'num_chains':num_chains,
+        'checkpoint_every':checkpoint_every,
+        'param_shapes':_latent_shapes(model, model_args_dict),
+    }
+    kernel, rng_key, init_state = _init_checkpointed(
+        rng_key, model, model_args_dict, num_warmup, num_chains, warm_start, init_state=not resuming
+    )
+
+    if resuming:
+        checkpoint = _load_pickle(state_path)
+        _check_checkpoint_settings(checkpoint, settings, state_path)
+        print('Resuming from iteration {} of {}'.format(
+            checkpoint['iteration'], num_warmup+num_samples
+        ))
+    else:
+        checkpoint = {
+            'last_state':init_state,
+            'iteration':0,
+            'settings':settings
+        }
+        # a fresh fit never adds to draws left in the store by an earlier one
+        if sample_store is not None and os.path.exists(sample_store):
+            os.remove(sample_store)
+
+    programs = {}
+    while checkpoint['iteration'] < num_warmup+num_samples:
+        iteration = checkpoint['iteration']
+        batch_length = _batch_length(iteration, num_warmup, num_samples, checkpoint_every)
+        collect = iteration >= num_warmup
+
+        if not (batch_length, collect) in programs:
+            programs[batch_length, collect] = _batch_program(
+                kernel, model_args_dict, batch_length, collect, num_chains, chain_method
+            )
+
+        batch_key = random.fold_in(rng_key, iteration)
+        state = checkpoint['last_state']
+        state = state._replace(rng_key=batch_key if num_chains == 1 else random.split(batch_key, num_chains))
+        last_state, (samples, diverging) = _run_batch(programs[batch_length, collect], state, num_chains, chain_method)
+
+        if collect:
+            # chains merged along the sample axis, as add_b_condition expects
+            samples = {
+                k:val.reshape((num_chains*batch_length,) + val.shape[(1 if num_chains == 1 else 2):])
+                for k,val in samples.items()
+            }
+            samples = add_b_condition(batch_key, model, samples, model_args_dict)
+            # keep the chain axis so convergence can be checked at the end
+            batch = {
+                k:onp.asarray(samples[k]).reshape((num_chains, batch_length) + samples[k].shape[1:])
+                for k in keep_params
+            }
+            diverging = diverging.reshape(num_chains, batch_length)
+            if sample_store is None:
+                batch['diverging'] = diverging
+                _dump_pickle(
+                    batch,
+                    os.path.join(checkpoint_dir, 'samples_{:06d}.pkl'.format(iteration-num_warmup))
+                )
+            else:
+                write_sample_batch(sample_store, batch, iteration-num_warmup, num_samples)
+                # divergences are small, keep them with the sampler state
+                checkpoint.setdefault('diverging', []).append(diverging.sum())
+
+        checkpoint['last_state'] = last_state
+        checkpoint['iteration'] = iteration+batch_length
+        _dump_pickle(checkpoint, state_path)
+        print('Iteration {} of {}'.format(checkpoint['iteration'], num_warmup+num_samples))
+
+    if sample_store is not None:
+        store = open_sample_store(sample_store)
+        print(store_convergence_summary(store))
+        print('Number of divergences: {}'.format(int(onp.sum(checkpoint.get('diverging', 0)))))
+        return store
+
+    batch_starts = range(0, num_samples, checkpoint_every)
+    batches = [
+        _load_pickle(os.path.join(checkpoint_dir, 'samples_{:06d}.pkl'.format(start)))
+        for start in batch_starts
+    ]
+    grouped_samples = {
+        k:onp.concatenate([batch[k] for batch in batches], axis=1)
+        for k in batches[0].keys()
+    }
+
+    divergences = grouped_samples.pop('diverging')
+    print(convergence_summary(grouped_samples))
+    print('Number of divergences: {}'.format(int(divergences.sum())))
+
+    # merge chains along the sample axis, as in sample_model
+    samples = {
+        k:val.reshape((-1,) + val.shape[2:])
+        for k,val in grouped_samples.items()
+    }
+
+    return samples
@@ -0,0 +1,181 @@
+import numpy as onp
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import jax.numpy as np
+import jax.random as random
+
+from . import init, host_device_count
+from .sampling import sample_model, sample_model_checkpointed, warm_up_sampler
+
+#%% sharded fitting
+# genes share only sigma in horseshoe_model, so blocks of genes can be fit
+#   independently and the per-gene parameters stitched back together.
+def _gid_key(model_args_dict):
+    # horseshoe_cell_model indexes genes per cell rather than per y_val
+    return 'gid' if 'gid' in model_args_dict else 'cell_gid'
+
+def shard_model_args(model_args_dict, gene_block):
+    """Subset model_args_dict to the genes in gene_block, re-indexing gid from 0."""
+    gid_key = _gid_key(model_args_dict)
+    gid = onp.asarray(model_args_dict[gid_key])
+    row_count = gid.shape[0]
+    keep = onp.isin(gid, gene_block)
+
+    new_gid = onp.zeros(gid.max()+1, dtype=gid.dtype)
+    new_gid[gene_block] = onp.arange(len(gene_block))
+
+    # subset every array with one entry per row of data along with gid
+    shard_args = {}
+    for key,val in model_args_dict.items():
+        if onp.ndim(val) > 0 and onp.shape(val)[0] == row_count:
+            shard_args[key] = onp.asarray(val)[keep]
+        else:
+            shard_args[key] = val
+    shard_args[gid_key] = new_gid[gid[keep]]
+    # a per-gene N is indexed by gene, not by row
+    if onp.ndim(model_args_dict['N']) > 0:
+        shard_args['N'] = onp.asarray(model_args_dict['N'])[gene_block]
+
+    # keep the prior identical to the full fit
+    if not 'variance' in shard_args:
+        shard_args['variance'] = onp.asarray(model_args_dict['y_vals']).var()
+    if not 'condition_count' in shard_args:
+        shard_args['condition_count'] = int(onp.asarray(model_args_dict['cid']).max()+1)
+
+    return shard_args
+
+def _sample_shard(shard_job):
+    # runs in a worker process, so only hand numpy arrays back to the parent
+    shard_idx, rng_key, model, shard_args, sample_kwargs, keep_params, device_count = shard_job
+    # a fresh interpreter, so set up its devices before sampling
+    init(device_count=device_count)
+
+    if sample_kwargs.get('checkpoint_dir') is not None:
+        # every shard checkpoints to its own sub-directory. Checkpointed
+        #   batches print their progress instead of a progress bar.
+        sample_kwargs = {k:val for k,val in sample_kwargs.items() if k != 'progress_bar'}
+        sample_kwargs['checkpoint_dir'] = os.path.join(
+            sample_kwargs['checkpoint_dir'],
+            'shard_{:04d}'.format(shard_idx)
+        )
+        samples = sample_model_checkpointed(
+            np.asarray(rng_key),
+            model,
+            shard_args,
+            keep_params=keep_params,
+            **sample_kwargs
+        )
+    else:
+        sample_kwargs = {
+            k:val for k,val in sample_kwargs.items()
+            if not k in ('checkpoint_dir','checkpoint_every')
+        }
+        samples = sample_model(
+            np.asarray(rng_key),
+            model,
+            shard_args,
+            **sample_kwargs
+        )
+    return {k:onp.asarray(samples[k]) for k in keep_params}
+
+def merge_shard_samples(shard_samples, gene_blocks):
+    """Stitch per-shard samples back into the layout of a single fit."""
+    # per-gene parameters are concatenated along the gene axis.
+    # sigma is fit separately in each shard, so keep each shard's draws
+    #   in shard_sigma and use their mean as sigma.
+    order = onp.argsort(onp.concatenate(gene_blocks))
+
+    samples = {}
+    for key in shard_samples[0].keys():
+        vals = [s[key] for s in shard_samples]
+        if vals[0].ndim > 1:
+            samples[key] = onp.concatenate(vals, axis=1)[:,order,...]
+        else:
+            samples['shard_'+key] = onp.stack(vals, axis=1)
+            samples[key] = samples['shard_'+key].mean(axis=1)
+
+    return samples
+
+def _gene_blocks(model_args_dict, shard_size):
+    genes = onp.unique(onp.asarray(model_args_dict[_gid_key(model_args_dict)]))
+    return [genes[i:i+shard_size] for i in range(0, len(genes), shard_size)]
+
+def _shard_workers(sample_kwargs, max_workers):
+    # num_chains=None runs helpers.host_device_count chains per shard. Each
+    #   worker gets one host device per parallel chain, and by default as
+    #   many workers run as their devices fit in the cores.
+    sample_kwargs = dict(sample_kwargs)
+    if sample_kwargs.get('num_chains', 1) is None:
+        sample_kwargs['num_chains'] = host_device_count
+    if sample_kwargs.get('chain_method') == 'parallel':
+        device_count = sample_kwargs['num_chains']
+    else:
+        device_count = 1
+    if max_workers is None:
+        max_workers = max(1, (os.cpu_count() or 1) // device_count)
+    return sample_kwargs, device_count, max_workers
+
+def _worker_pool(max_workers):
+    # jax is not fork-safe, so start fresh interpreters for the workers
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context('spawn')
+    )
+
+def _warm_up_shard(warm_up_job):
+    rng_key, model, shard_args, warm_up_kwargs, device_count = warm_up_job
+    init(device_count=device_count)
+    warm_up_sampler(np.asarray(rng_key), model, shard_args, **warm_up_kwargs)
+
+def warm_up_sharded(rng_key, model, model_args_dict, shard_size=500, max_workers=None, **warm_up_kwargs):
+    """warm_up_sampler for each distinct shape of the shards of sample_model_sharded.
+
+    Compiled programs are only loaded by processes with the same host
+    devices, so this compiles in workers set up like the fit's.
+    """
+    warm_up_kwargs, device_count, max_workers = _shard_workers(warm_up_kwargs, max_workers)
+
+    jobs = []
+    shapes_seen = set()
+    for block in _gene_blocks(model_args_dict, shard_size):
+        shard_args = shard_model_args(model_args_dict, block)
+        shapes = tuple(sorted((k, onp.shape(val)) for k,val in shard_args.items()))
+        if not shapes in shapes_seen:
+            shapes_seen.add(shapes)
+            jobs.append((onp.asarray(rng_key), model, shard_args, warm_up_kwargs, device_count))
+
+    with _worker_pool(max_workers) as pool:
+        list(pool.map(_warm_up_shard, jobs))
+
+def sample_model_sharded(rng_key,
+                         model,
+                         model_args_dict,
+                         shard_size=500,
+                         max_workers=None,
+                         keep_params=('alpha','b_condition','sigma'),
+                         **sample_kwargs):
+    """Fit model separately on blocks of shard_size genes across a process pool.
+
+    Passing checkpoint_dir samples each shard with sample_model_checkpointed.
+    num_chains=None runs helpers.host_device_count chains per shard. Each
+    worker gets one host device per parallel chain, and max_workers defaults
+    to the number of cores divided by that, so all the shards' chains
+    together run about one per core.
+    """
+    sample_kwargs, device_count, max_workers = _shard_workers(sample_kwargs, max_workers)
+
+    gene_blocks = _gene_blocks(model_args_dict, shard_size)
+    shard_keys = onp.asarray(random.split(rng_key, len(gene_blocks)))
+
+    jobs = [
+        (i, shard_keys[i], model, shard_model_args(model_args_dict, block), sample_kwargs, keep_params, device_count)
+        for i,block in enumerate(gene_blocks)
+    ]
+
+    with _worker_pool(max_workers) as pool:
+        shard_samples = list(pool.map(_sample_shard, jobs))
+
+    return merge_shard_samples(shard_samples, gene_blocks)
@@ -0,0 +1,118 @@
+import numpy as onp
+
+import os
+import json
+import pickle
+import h5py
+
+#%% pickles written so an interrupted write never replaces the last good one
+def _dump_pickle(obj, path):
+    # write to a temporary file first so an interrupted write
+    #   never replaces the last good checkpoint
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as pkl_file:
+        pickle.dump(obj, pkl_file)
+    os.replace(tmp_path, path)
+
+def _load_pickle(path):
+    with open(path, 'rb') as pkl_file:
+        return pickle.load(pkl_file)
+
+#%% streaming sample storage
+# posterior samples are written to an HDF5 file with one chunked,
+#   compressed dataset per parameter. Draws are stored with chains merged
+#   along the first axis, as returned by sample_model, so a dataset can be
+#   sliced lazily like the arrays in a samples dict.
+def write_sample_batch(path, batch, start, num_samples):
+    """Write a batch of draws grouped by chain into the sample store at path.
+
+    Raises ValueError if the store already holds a parameter with a
+    different shape or number of chains, e.g. from an earlier fit.
+    """
+    with h5py.File(path, 'a') as store:
+        for param,x in batch.items():
+            num_chains, batch_length = x.shape[:2]
+            shape = (num_chains*num_samples,) + x.shape[2:]
+            if not param in store:
+                dset = store.create_dataset(
+                    param,
+                    shape=shape,
+                    dtype=x.dtype,
+                    chunks=True,
+                    compression='gzip',
+                    shuffle=True
+                )
+                dset.attrs['num_chains'] = num_chains
+            dset = store[param]
+            if dset.shape != shape or dset.attrs['num_chains'] != num_chains:
+                raise ValueError(
+                    '{} in sample store {} has shape {} from {} chains, but this fit gives {} from {} chains'.format(
+                        param, path, dset.shape, dset.attrs['num_chains'], shape, num_chains
+                    )
+                )
+            for chain in range(num_chains):
+                offset = chain*num_samples + start
+                dset[offset:offset+batch_length] = x[chain]
+
+def open_sample_store(path):
+    """Open a sample store read-only; each parameter is read only when sliced."""
+    return h5py.File(path, 'r')
+
+#%% memory-mapped sample storage
+# one uncompressed .npy file per parameter can be memory-mapped, so slicing
+#   a parameter (e.g. one condition of b_condition) only reads those values.
+def _source_stamp(source_path):
+    stat = os.stat(source_path)
+    return {'path':os.path.abspath(source_path), 'size':stat.st_size, 'mtime_ns':stat.st_mtime_ns}
+
+def save_samples_npy(samples, directory, params=None, chunk_size=50, source_path=None):
+    """Save parameters from a samples dict or sample store to directory/<param>.npy.
+
+    source_path is the file samples were read from; its size and modification
+    time are recorded for samples_npy_is_current.
+    """
+    os.makedirs(directory, exist_ok=True)
+    # a partly rewritten directory is never current
+    stamp_path = os.path.join(directory, 'source.json')
+    if os.path.exists(stamp_path):
+        os.remove(stamp_path)
+    if params is None:
+        params = list(samples.keys())
+
+    for param in params:
+        x = samples[param]
+        out = onp.lib.format.open_memmap(
+            os.path.join(directory, param + '.npy'),
+            mode='w+',
+            dtype=x.dtype,
+            shape=x.shape
+        )
+        # copy chunk_size draws at a time so the whole parameter is never in memory
+        for i in range(0, x.shape[0], chunk_size):
+            out[i:i+chunk_size] = x[i:i+chunk_size]
+        out.flush()
+        del out
+
+    if source_path is not None:
+        with open(stamp_path, 'w') as stamp_file:
+            json.dump(_source_stamp(source_path), stamp_file)
+
+def samples_npy_is_current(directory, source_path):
+    """True if directory holds samples saved from source_path as it is now."""
+    stamp_path = os.path.join(directory, 'source.json')
+    if not os.path.exists(stamp_path):
+        return False
+    with open(stamp_path) as stamp_file:
+        return json.load(stamp_file) == _source_stamp(source_path)
+
+def load_samples_npy(directory, params=None, mmap_mode='r'):
+    """Load parameters saved by save_samples_npy as memory-mapped arrays."""
+    if params is None:
+        params = sorted(f[:-len('.npy')] for f in os.listdir(directory) if f.endswith('.npy'))
+
+    samples = {
+        param:onp.load(os.path.join(directory, param + '.npy'), mmap_mode=mmap_mode)
+        for param in params
+    }
+
+    return samples
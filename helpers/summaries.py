@@ -0,0 +1,206 @@
+import numpy as onp
+import pandas as pd
+
+from concurrent.futures import ThreadPoolExecutor
+import functools
+
+#%% posterior summaries of samples held as numpy arrays
+def _hpdi_from_sorted(sorted_x, prob):
+    # same interval as numpyro.diagnostics.hpdi, for values already sorted along the last axis
+    mass = sorted_x.shape[-1]
+    index_length = int(prob * mass)
+    intervals_left = sorted_x[...,:(mass - index_length)]
+    intervals_right = sorted_x[...,index_length:]
+    index_start = (intervals_right - intervals_left).argmin(axis=-1)[...,None]
+    hpd_left = onp.take_along_axis(sorted_x, index_start, axis=-1)[...,0]
+    hpd_right = onp.take_along_axis(sorted_x, index_start + index_length, axis=-1)[...,0]
+    return hpd_left, hpd_right
+
+def _sorted_summaries(x, probs=(), median=False, chunk_size=4096, num_threads=None):
+    # sort chunk_size elements of x (samples x elements) at a time and take
+    #   every HPDI in probs, and the median, from that one sort. numpy's
+    #   sort releases the GIL, so chunks run in parallel threads.
+    sample_count,element_count = x.shape
+    dtype = onp.result_type(x.dtype, onp.float32)
+    out = {prob:onp.empty((2,element_count), dtype=dtype) for prob in probs}
+    if median:
+        out['median'] = onp.empty(element_count, dtype=dtype)
+
+    def summarize_chunk(start):
+        chunk = slice(start, start+chunk_size)
+        # sorting a contiguous elements x samples copy along its last axis
+        #   is much faster than sorting down the columns of x
+        sorted_x = onp.ascontiguousarray(x[:,chunk].T, dtype=dtype)
+        sorted_x.sort(axis=-1)
+        for prob in probs:
+            out[prob][0,chunk],out[prob][1,chunk] = _hpdi_from_sorted(sorted_x, prob)
+        if median:
+            mid = sample_count // 2
+            out['median'][chunk] = (sorted_x[:,mid] + sorted_x[:,-mid-1]) / 2
+
+    with ThreadPoolExecutor(max_workers=num_threads) as pool:
+        list(pool.map(summarize_chunk, range(0, element_count, chunk_size)))
+
+    return out
+
+def batched_hpdi(x, probs=(0.9,), axis=0, chunk_size=4096, num_threads=None):
+    """HPDI along axis for every prob in probs from one sort, as {prob:(lower, upper)}.
+
+    Elements are sorted chunk_size at a time across num_threads threads.
+    """
+    x = onp.moveaxis(onp.asarray(x), axis, 0)
+    out_shape = x.shape[1:]
+    bounds = _sorted_summaries(
+        x.reshape(x.shape[0], -1),
+        probs=probs,
+        chunk_size=chunk_size,
+        num_threads=num_threads
+    )
+
+    return {prob:(b[0].reshape(out_shape), b[1].reshape(out_shape)) for prob,b in bounds.items()}
+
+def summarize_samples(x,
+                      key_name,
+                      id_var,
+                      prob=0.9,
+                      stats=('mean','hpdi'),
+                      axis=0,
+                      chunk_size=4096,
+                      num_threads=None):
+    """Long table of posterior statistics for each id x key element of x.
+
+    x has one axis of samples (axis) plus an id and a key axis. stats can
+    include 'mean', 'hpdi', 'median', 'sd' and 'prob_positive'. prob can be
+    a sequence of probabilities, giving lower_cl_<pct>/upper_cl_<pct>
+    columns; all of them and the median come from one sort of the samples.
+    """
+    x = onp.moveaxis(onp.asarray(x), axis, 0)
+    sample_count,id_count,key_count = x.shape
+
+    columns = {
+        # same row order as melting a wide ids x keys table
+        id_var:onp.tile(onp.arange(id_count), key_count),
+        key_name:onp.repeat(onp.arange(key_count), id_count),
+    }
+
+    # samples x elements view of x; statistics are put in key-major order
+    #   afterwards to match the id and key columns
+    x_flat = x.reshape(sample_count, -1)
+
+    def flat(stat):
+        return onp.asarray(stat).reshape(id_count, key_count).ravel(order='F')
+
+    if 'mean' in stats:
+        columns['mean_val'] = flat(x_flat.mean(axis=0))
+    if 'hpdi' in stats or 'median' in stats:
+        probs = onp.atleast_1d(prob).tolist() if 'hpdi' in stats else []
+        sorted_stats = _sorted_summaries(
+            x_flat,
+            probs=probs,
+            median='median' in stats,
+            chunk_size=chunk_size,
+            num_threads=num_threads
+        )
+        for p in probs:
+            suffix = '' if onp.ndim(prob) == 0 else '_{:g}'.format(p*100)
+            columns['lower_cl' + suffix] = flat(sorted_stats[p][0])
+            columns['upper_cl' + suffix] = flat(sorted_stats[p][1])
+        if 'median' in stats:
+            columns['median_val'] = flat(sorted_stats['median'])
+    if 'sd' in stats:
+        columns['sd_val'] = flat(x_flat.std(axis=0))
+    if 'prob_positive' in stats:
+        columns['prob_positive'] = flat((x_flat > 0).mean(axis=0))
+
+    return pd.DataFrame(columns)
+
+def get_mean_and_ci(x, key_name, id_var, prob=0.9, axis=0):
+    df = summarize_samples(x, key_name, id_var, prob=prob, axis=axis)
+    df = df.set_index([id_var,key_name])
+
+    return df
+
+def rereference(alpha, b_condition, baseline_idx, inplace=False, dtype=None):
+    """Re-express each gene's intercept and condition effects relative to a baseline condition.
+
+    new_alpha = alpha + b_condition[...,baseline_idx]
+    new_beta = b_condition - b_condition[...,baseline_idx]
+    With inplace=True, new_beta overwrites b_condition, which must be a
+    writeable array (not e.g. a read-only memory map from load_samples_npy)
+    and already have dtype if one is given. dtype sets the output dtype
+    (e.g. onp.float32); by default the input dtype is kept.
+    """
+    if inplace:
+        if not isinstance(b_condition, onp.ndarray) or not b_condition.flags.writeable:
+            raise ValueError('inplace=True needs b_condition to be a writeable numpy array')
+        if dtype is not None and onp.dtype(dtype) != b_condition.dtype:
+            raise ValueError('inplace=True keeps b_condition as {}, not dtype {}'.format(
+                b_condition.dtype, onp.dtype(dtype)
+            ))
+
+    # copy the baseline so overwriting b_condition in place does not change it
+    baseline = onp.array(b_condition[...,baseline_idx], dtype=dtype)
+    new_alpha = onp.add(alpha, baseline, dtype=dtype)
+
+    if inplace:
+        new_beta = onp.subtract(b_condition, baseline[...,None], out=b_condition)
+    else:
+        new_beta = onp.subtract(b_condition, baseline[...,None], dtype=dtype)
+
+    return new_alpha, new_beta
+
+#%% Gini coefficients of posterior draws, in numpy
+@functools.lru_cache(maxsize=None)
+def _gini_weights(n, dtype):
+    # rank weights (2i - n - 1) of the sorted values in gini
+    weights = 2*onp.arange(1,n+1) - n - 1
+    return weights.astype(dtype)
+
+def fast_gini(array, prep=False, buffer=None):
+    """Gini coefficient along the last axis of array, same as gini (or gini(prep_for_gini(array)) with prep=True).
+
+    Values are sorted in place in buffer (allocated if not given, reuse it
+    across calls) and weighted with precomputed rank weights in one matmul.
+    """
+    n = array.shape[-1]
+    if buffer is None:
+        buffer = onp.empty(array.shape, dtype=onp.result_type(array.dtype, onp.float32))
+    buffer[...] = array
+    buffer.sort(axis=-1)
+
+    numerator = buffer @ _gini_weights(n, buffer.dtype)
+    total = buffer.sum(axis=-1)
+    if prep:
+        # prep_for_gini shifts each row so its minimum is 0.0000001. The
+        #   rank weights sum to 0, so the shift only changes the denominator.
+        total = total - n*(buffer[...,0] - 0.0000001)
+
+    return numerator / (n * total)
+
+def gini_draws(beta, chunk_size=50):
+    """Gini coefficient of each gene's condition effects for every posterior draw."""
+    draw_count = beta.shape[0]
+    gini_arr = onp.empty(beta.shape[:2], dtype=onp.float32)
+
+    # one sort buffer for all chunks
+    buffer = onp.empty((chunk_size,) + beta.shape[1:], dtype=onp.float32)
+    for start in range(0, draw_count, chunk_size):
+        chunk = beta[start:start+chunk_size]
+        gini_arr[start:start+chunk.shape[0]] = fast_gini(
+            chunk,
+            prep=True,
+            buffer=buffer[:chunk.shape[0]]
+        )
+
+    return gini_arr
+
+def gini_summary(beta, prob=0.9, chunk_size=50, return_draws=False):
+    """Posterior mean and HPDI of each gene's Gini coefficient, chunk_size draws at a time."""
+    gini_arr = gini_draws(beta, chunk_size=chunk_size)
+    mean_gini = gini_arr.mean(axis=0)
+    gini_low,gini_up = batched_hpdi(gini_arr, probs=(prob,), axis=0)[prob]
+
+    if return_draws:
+        return mean_gini, gini_low, gini_up, gini_arr
+
+    return mean_gini, gini_low, gini_up
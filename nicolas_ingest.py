@@ -0,0 +1,24 @@
+#%%
+import os
+
+import design_helpers as dh
+
+# %%
+direc = '.'
+
+# genes and conditions in saved vocabularies keep their ids, as in create_gene_info.py
+incremental = True
+# rows of Table S2 in memory at a time
+chunksize = 500
+
+#%% melt Table S2 to long format, mark head-on genes, attach Table S1
+#   sample metadata and encode the design, in one pass over Table S2
+dh.ingest_table_s2(
+    os.path.join(direc, 'TableS2_Nicolas_et_al.csv'),
+    os.path.join(direc, 'TableS1_Nicolas_mader_dervyn_et_al.tsv'),
+    direc,
+    incremental=incremental,
+    chunksize=chunksize
+)
+
+# %%
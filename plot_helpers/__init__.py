@@ -0,0 +1,25 @@
+"""Plotting helpers; altair and seaborn are only imported by the plots that use them."""
+import importlib
+
+_submodule_names = {
+    'altair_plots':[
+        'density_curves', 'group_means', 'set_base_density_chart', 'make_mean_rule',
+        'encode_density', 'plot_density', 'plot_ginis', 'plot_bars',
+    ],
+    'seaborn_plots':['plot_bars_sns'],
+}
+_submodule_of = {
+    name:submodule for submodule,names in _submodule_names.items() for name in names
+}
+
+def __getattr__(name):
+    if name in _submodule_names:
+        return importlib.import_module('.' + name, __name__)
+    if name in _submodule_of:
+        val = getattr(importlib.import_module('.' + _submodule_of[name], __name__), name)
+        globals()[name] = val
+        return val
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+def __dir__():
+    return sorted(list(globals()) + list(_submodule_names) + list(_submodule_of))
@@ -0,0 +1,319 @@
+import altair as alt
+import numpy as onp
+import pandas as pd
+
+#%% densities and means computed in python, so charts only hold the curves
+def _group_codes(df, groupby):
+    # group of each row and a table of the groups' keys
+    if not groupby:
+        return onp.zeros(df.shape[0], dtype=onp.int64), pd.DataFrame(index=[0])
+    grouped = df.groupby(groupby, observed=True, sort=True)
+    return grouped.ngroup().to_numpy(), grouped.size().index.to_frame(index=False)
+
+def _scott_bandwidth(x, codes):
+    # the rule of thumb transform_density uses, for each group
+    by_group = pd.Series(x).groupby(codes)
+    n = by_group.size().to_numpy()
+    sd = by_group.std().fillna(0).to_numpy()
+    quartiles = by_group.quantile([0.25,0.75]).unstack().to_numpy()
+    spread = onp.minimum(sd, (quartiles[:,1] - quartiles[:,0]) / 1.34)
+    spread = onp.where(spread > 0, spread, onp.where(sd > 0, sd, onp.abs(quartiles[:,0])))
+    spread = onp.where(spread > 0, spread, 1.)
+    return 1.06 * spread * n**-0.2
+
+def density_curves(df, data_var, groupby=(), steps=200, extent=None, bandwidth=None, oversample=8):
+    """Gaussian KDE of data_var in each group of the groupby columns, at steps points across extent.
+
+    The same estimate as transform_density: bandwidth defaults to Scott's
+    rule for each group and extent to the range of data_var. Values are
+    linearly binned onto a grid oversample times finer than the output and
+    smoothed with each group's kernel by FFT, so only the binning grows with
+    the number of rows. Returns a long table of the groupby columns,
+    data_var and density.
+    """
+    groupby = list(groupby)
+    x = df[data_var].to_numpy(dtype=onp.float64)
+    keep = ~onp.isnan(x)
+    codes,keys = _group_codes(df[keep], groupby)
+    x = x[keep]
+    group_count = keys.shape[0]
+    n = onp.bincount(codes, minlength=group_count)
+
+    if bandwidth is None:
+        bandwidth = _scott_bandwidth(x, codes)
+    else:
+        bandwidth = onp.full(group_count, bandwidth, dtype=onp.float64)
+    if extent is None:
+        extent = (x.min(), x.max())
+    lo,hi = extent
+
+    # fine grid padded by 5 of the widest kernel's sd on both sides, so values
+    #   near the ends are smoothed as if there were no ends
+    fine_steps = (steps-1)*oversample + 1
+    dx = (hi - lo) / (fine_steps-1)
+    pad = int(onp.ceil(5*bandwidth.max() / dx))
+    size = fine_steps + 2*pad
+
+    pos = (x - lo)/dx + pad
+    inside = (pos >= 0) & (pos <= size-1)
+    pos,codes = pos[inside],codes[inside]
+    left = onp.minimum(onp.floor(pos).astype(onp.int64), size-2)
+    frac = pos - left
+    flat = codes*size + left
+    counts = (
+        onp.bincount(flat, weights=1-frac, minlength=group_count*size)
+        + onp.bincount(flat+1, weights=frac, minlength=group_count*size)
+    ).reshape(group_count, size)
+
+    # Gaussian smoothing is a product in frequency space; the extra pad of
+    #   zeros keeps the ends from wrapping around into each other
+    fft_size = size + pad
+    freq = onp.fft.rfftfreq(fft_size)
+    kernel = onp.exp(-0.5 * (2*onp.pi*freq[None,:]*(bandwidth/dx)[:,None])**2)
+    smoothed = onp.fft.irfft(onp.fft.rfft(counts, n=fft_size) * kernel, n=fft_size)
+    density = onp.maximum(smoothed[:,pad:pad+fine_steps:oversample], 0) / (n[:,None]*dx)
+
+    curves = keys.iloc[onp.repeat(onp.arange(group_count), steps)].reset_index(drop=True)
+    curves[data_var] = onp.tile(onp.linspace(lo, hi, steps), group_count)
+    curves['density'] = density.ravel()
+    return curves
+
+def group_means(df, data_var, groupby=()):
+    """Mean of data_var in each group of the groupby columns."""
+    if not groupby:
+        return pd.DataFrame({data_var:[df[data_var].mean()]})
+    return df.groupby(list(groupby), observed=True, sort=True)[data_var].mean().reset_index()
+
+#%%
+
+def set_base_density_chart(base_chart,
+                           data_var,
+                           color_var=None,
+                           extent=None):
+
+    if color_var is None:
+        density_base = base_chart.transform_density(
+            data_var,
+            as_=[data_var,'density'],
+        )
+    else:
+        density_base = base_chart.transform_density(
+            data_var,
+            as_=[data_var,'density'],
+            groupby=[color_var],
+        )
+
+    return(density_base)
+
+def make_mean_rule(base_chart, other_chart, data_var, color_var=None, aggregated=False):
+
+    # aggregated tables from plot_density hold the means as rows without a density
+    if aggregated:
+        base_chart = base_chart.transform_filter('!isValid(datum.density)')
+        mean_field = '{}:Q'.format(data_var)
+    else:
+        mean_field = 'mean({})'.format(data_var)
+
+    if color_var is None:
+        rule_chart = base_chart.mark_rule().encode(
+            x=alt.X(
+                mean_field,
+                scale=alt.Scale(zero=False)
+            ),
+            size=alt.value(3)
+        )
+
+    else:
+        rule_chart = base_chart.mark_rule().encode(
+            x=alt.X(
+                mean_field,
+                scale=alt.Scale(zero=False)
+            ),
+            size=alt.value(3),
+            color='{}:N'.format(color_var)
+        )
+
+    plot = rule_chart + other_chart
+
+    return(plot)
+
+def encode_density(base_chart,
+                   data_var,
+                   color_var,
+                   x_lab,
+                   y_lab,
+                   stack,
+                   aggregated=False):
+
+    if aggregated:
+        density_base = base_chart.transform_filter('isValid(datum.density)')
+    else:
+        density_base = set_base_density_chart(
+            base_chart,
+            data_var,
+            color_var,
+        )
+
+    density_plot = density_base.mark_area(
+        opacity=0.35,
+    ).encode(
+        alt.X(
+            '{}:Q'.format(data_var),
+            title=x_lab
+        ),
+        alt.Y(
+            'density:Q',
+            title=y_lab,
+            stack=stack
+        )
+    )
+
+    return(density_plot)
+
+def plot_density(
+    df,
+    data_var,
+    condition=None,
+    x_lab='',
+    y_lab='',
+    color_var=None,
+    stack=False,
+    include_mean=True,
+    facet_var=None,
+    aggregate=False,
+    steps=200
+    ):
+    """Density of data_var, optionally by color_var and faceted by facet_var.
+
+    By default the chart holds df and the renderer computes the densities
+    and means. With aggregate=True they are computed here (density_curves
+    on steps points, group_means) and the chart only holds those, so its
+    size does not depend on the number of rows in df.
+    """
+
+    if condition is not None:
+        if type(condition) == str:
+            df = df[df.condition == condition]
+        else:
+            df = df[df.condition.isin(condition)]
+
+    if aggregate:
+        groupby = [var for var in (color_var, facet_var) if var is not None]
+        # curves and means in one table, so the layers can be faceted together
+        chart_df = pd.concat(
+            [density_curves(df, data_var, groupby, steps=steps), group_means(df, data_var, groupby)],
+            ignore_index=True
+        )
+    else:
+        chart_df = df
+
+    base_chart = alt.Chart(chart_df)
+
+    density_chart = encode_density(
+        base_chart,
+        data_var,
+        color_var,
+        x_lab,
+        y_lab,
+        stack,
+        aggregated=aggregate
+    )
+
+    if include_mean:
+        plot = make_mean_rule(
+            base_chart,
+            density_chart,
+            data_var,
+            color_var,
+            aggregated=aggregate
+        )
+    else:
+        plot = density_chart
+
+    if color_var is not None:
+        plot = plot.encode(color='{}:N'.format(color_var))
+
+    if facet_var is not None:
+        plot = plot.facet(row='{}:N'.format(facet_var))
+        plot = plot.configure_legend(
+            strokeColor='gray',
+            fillColor='white',
+            padding=10,
+            cornerRadius=10,
+            orient='none',
+            legendX=14,
+            legendY=0.14,
+            symbolType='square'
+        )
+    else:
+        plot = plot.configure_legend(
+            strokeColor='gray',
+            fillColor='white',
+            padding=10,
+            cornerRadius=10,
+            orient='top-right',
+            symbolType='square'
+        )
+
+    plot = plot.configure_axis(
+        labelFontSize=15,
+        titleFontSize=15
+    )
+
+    return(plot)
+
+
+def plot_ginis(df, color_var=None, facet_var=None):
+
+    line = alt.Chart(df).mark_line().encode(
+        x=alt.X('x_vals', title='Gene'),
+        y=alt.Y('mean_val', title='Gini'),
+        color='{}:N'.format(color_var),
+        tooltip='gene'
+    )
+
+    band = alt.Chart(df).mark_area().encode(
+        x=alt.X('x_vals', title='Gene'),
+        y=alt.Y('lower_cl', title='Gini'),
+        y2=alt.Y2('upper_cl', title='Gini'),
+        opacity=alt.value(0.35),
+        fill='{}:N'.format(color_var),
+        tooltip='gene'
+    )
+
+    if color_var is not None:
+        plot = (line + band).encode(
+            color='{}:N'.format(color_var)
+        )
+    else:
+        plot = line + band
+
+    if facet_var is not None:
+        plot = plot.facet(
+            row='{}:N'.format(facet_var)
+        )
+
+    return(plot)
+
+def plot_bars(df, color_var=None):
+
+    bar = alt.Chart(df).mark_bar().encode(
+        column=alt.Column(
+            'regulator:N',
+            axis=alt.Axis(
+                # axisWidth=1.0,
+                offset=-8.0,
+                orient='bottom'
+            ),
+            scale=alt.Scale(padding=4.0)
+        ),
+        x=alt.X('headon:O', title='Regulator', axis=False),
+        y=alt.Y(
+            'percent:Q',
+            title='Proportion of head-on or co-directional genes regulated by X',
+            axis=alt.Axis(grid=False),
+        ),
+        color='{}:N'.format(color_var),
+    )
+
+    return(bar)
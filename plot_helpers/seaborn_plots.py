@@ -0,0 +1,18 @@
+import seaborn as sns
+
+def plot_bars_sns(df, color_var=None):
+
+    bar = sns.catplot(
+        x="regulator",
+        y="percent",
+        hue=color_var,
+        data=df,
+        kind='bar',
+        legend_out=True,
+    )
+
+    bar.set_ylabels("Percentage of head-on or co-directional CDSs regulated by x")
+    bar.set_xlabels("Regulator")
+    bar._legend.remove()
+    bar.ax.legend(loc="upper right")
+    return(bar)
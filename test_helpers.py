@@ -0,0 +1,106 @@
+import numpy as onp
+
+import helpers as h
+
+def test_fast_gini_matches_gini():
+    h.init(device_count=1, compilation_cache=False)
+    rng = onp.random.default_rng(0)
+    # genes x conditions, like one posterior draw of new_beta
+    x = rng.normal(0, 2, size=(200, 100)).astype(onp.float32)
+
+    assert onp.allclose(h.fast_gini(x, prep=True), h.gini(h.prep_for_gini(x)), rtol=1e-4)
+    positive = x - x.min() + 1
+    assert onp.allclose(h.fast_gini(positive), h.gini(positive), rtol=1e-4)
+
+def test_batched_hpdi_matches_numpyro_hpdi():
+    from numpyro.diagnostics import hpdi
+    rng = onp.random.default_rng(0)
+    # draws x genes x conditions, skewed so the interval isn't symmetric
+    x = rng.gamma(2., size=(500, 7, 3))
+
+    # small chunks across threads, so elements are split over several sorts
+    bounds = h.batched_hpdi(x, probs=(0.5, 0.9), chunk_size=5, num_threads=2)
+    for prob,(lower,upper) in bounds.items():
+        expected = hpdi(x, prob, axis=0)
+        assert onp.allclose(lower, expected[0])
+        assert onp.allclose(upper, expected[1])
+
+    # along another axis, where numpyro stacks the bounds in place of that axis
+    lower,upper = h.batched_hpdi(x, probs=(0.9,), axis=1)[0.9]
+    expected = onp.moveaxis(hpdi(x, 0.9, axis=1), 1, 0)
+    assert onp.allclose(lower, expected[0])
+    assert onp.allclose(upper, expected[1])
+
+def _replicated_design(missing_cell=None):
+    # 6 genes x 4 conditions with 1 to 3 replicates per cell
+    gid, cid = [], []
+    for gene in range(6):
+        for condition in range(4):
+            if (gene, condition) != missing_cell:
+                replicates = 1 + (gene + condition) % 3
+                gid += [gene]*replicates
+                cid += [condition]*replicates
+    gid, cid = onp.array(gid), onp.array(cid)
+    y_vals = onp.random.default_rng(0).normal(10, 2, size=gid.size).astype(onp.float32)
+    return y_vals, gid, cid
+
+def test_cell_models_match_horseshoe_model_log_density():
+    import jax.random as random
+    import numpyro
+    import numpyro.distributions as dist
+    from numpyro.infer.util import log_density
+
+    h.init(device_count=1, compilation_cache=False)
+    missing_cell = (2, 1)
+    y_vals, gid, cid = _replicated_design(missing_cell)
+    N = onp.bincount(gid)
+    model_args = {'y_vals':y_vals, 'gid':gid, 'cid':cid, 'N':N}
+
+    model_trace = numpyro.handlers.trace(
+        numpyro.handlers.seed(h.horseshoe_model, random.PRNGKey(1))
+    ).get_trace(**model_args)
+    params = {
+        name:site['value'] for name,site in model_trace.items()
+        if site['type'] == 'sample' and not site['is_observed']
+    }
+    expected = float(log_density(h.horseshoe_model, (), model_args, params)[0])
+
+    # horseshoe_cell_model has no beta_tilde or lambd for the unobserved cell
+    cell_args = h.aggregate_cells(y_vals, gid, cid)
+    cell_args['N'] = N
+    cell_params = dict(params)
+    for name in ['beta_tilde', 'lambd']:
+        cell_params[name] = params[name][cell_args['cell_gid'], cell_args['cell_cid']]
+    unobserved = (
+        dist.Normal(0., 1.).log_prob(params['beta_tilde'][missing_cell])
+        + dist.HalfCauchy(1.).log_prob(params['lambd'][missing_cell])
+    )
+    cell_log_density = log_density(h.horseshoe_cell_model, (), cell_args, cell_params)[0]
+    assert onp.isclose(float(cell_log_density + unobserved), expected, rtol=1e-5)
+
+    # horseshoe_grid_model keeps every cell and has alpha as genes x 1
+    grid_args = h.aggregate_cells(y_vals, gid, cid, dense=True)
+    grid_args['N'] = N
+    grid_params = dict(params, alpha=params['alpha'][:,None])
+    grid_log_density = log_density(h.horseshoe_grid_model, (), grid_args, grid_params)[0]
+    assert onp.isclose(float(grid_log_density), expected, rtol=1e-5)
+
+def test_enrichment_tests_match_scipy():
+    from scipy import stats
+    import enrichment_helpers as eh
+
+    rng = onp.random.default_rng(0)
+    # small and unbalanced tables, like those of small regulons
+    tables = rng.integers(0, 30, size=(200, 2, 2))
+    tables[:50,:,1] = rng.integers(0, 4, size=(50, 2))
+
+    chi2, p_chi2 = eh.chi2_test(tables)
+    p_fisher = eh.fisher_test(tables)
+    for table,statistic,p_value,p_exact in zip(tables, chi2, p_chi2, p_fisher):
+        if (stats.contingency.expected_freq(table) > 0).all():
+            expected = stats.chi2_contingency(table)
+            assert onp.isclose(statistic, expected[0])
+            assert onp.isclose(p_value, expected[1])
+        else:
+            assert onp.isnan(statistic)
+        assert onp.isclose(p_exact, stats.fisher_exact(table)[1])
@@ -0,0 +1,45 @@
+#%%
+import jax.random as random
+
+import helpers as h
+import design_helpers as dh
+# only the settings are imported, the fit itself runs under __main__
+import big_horseshoe_model_fit_script as fit
+
+h.init()
+
+# compiles the checkpointed sampler for the fit set up in
+#   big_horseshoe_model_fit_script.py without sampling, filling the
+#   compilation cache (h.compilation_cache_dir) so the fit loads it instead
+#   of compiling. Rerun after changing the data or the fit settings.
+
+if __name__ == '__main__':
+
+    if fit.checkpoint_dir is None or fit.use_svi or fit.condition_subsets is not None:
+        raise SystemExit('Only checkpointed NUTS fits (checkpoint_dir set) can be compiled ahead')
+    if fit.previous_fit_state is not None and fit.shard_size is not None:
+        raise SystemExit('previous_fit_state only works without shard_size')
+
+    data = dh.load_design_table(fit.direc)
+    N = dh.validate_design(data)['N']
+
+    #%%
+    model, data_dict = fit.model_and_data(data, N)
+
+    rng_key = random.PRNGKey(0)
+    warm_up_kwargs = {
+        'num_warmup':fit.num_warmup,
+        'num_samples':fit.num_samples,
+        'checkpoint_every':fit.checkpoint_every,
+        'num_chains':fit.num_chains,
+        'chain_method':fit.chain_method,
+    }
+    if fit.previous_fit_state is not None:
+        warm_up_kwargs['num_warmup'] = fit.warm_start_num_warmup
+        warm_up_kwargs['warm_start'] = h.warm_start_from_checkpoint(fit.previous_fit_state, model, data_dict)
+
+    #%%
+    if fit.shard_size is not None:
+        h.warm_up_sharded(rng_key, model, data_dict, shard_size=fit.shard_size, max_workers=fit.max_workers, **warm_up_kwargs)
+    else:
+        h.warm_up_sampler(rng_key, model, data_dict, **warm_up_kwargs)